@@ -0,0 +1,403 @@
+"""
+Benchmark and replay harness for AutoMod.check_message.
+
+Messages (synthetic, or recorded in a JSON lines file) are fed thru check_message(act=False) with stubbed discord
+objects, the real Settings/Cache helpers, and a fake Api returning default settings, so it runs completely offline.
+
+It reports the throughput, the p50/p99 latency per scenario, and how much time the main checks take on their own.
+
+Run it from the repository root with
+> python -m benchmarks.automod
+> python -m benchmarks.automod --messages 50000 --guilds 50
+> python -m benchmarks.automod --replay recorded_messages.jsonl
+
+Recorded messages are JSON objects, one per line, like
+{"scenario": "recorded", "content": "hello", "author_id": 1234, "mentions": [5678], "channel_topic": ""}
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import random
+import statistics
+import time
+import typing
+
+import discord
+
+from cogs.automod import AutoMod, CheckMessage, TRIGGERS_PHRASES_MATCHER, get_enabled_triggers
+from cogs.helpers.cache import Cache
+from cogs.helpers.guild_settings import Settings
+from cogs.helpers.level import get_level
+
+BOT_USER_ID = 492797767916191745
+
+DEFAULT_SETTINGS = {
+    'vip': False,
+    'vip_custom_bad_words_list': '',
+    'vip_custom_bad_regex_list': '',
+    'permissions_admins': [],
+    'permissions_moderators': [],
+    'permissions_trusted': [],
+    'permissions_banned': [],
+    'automod_enable': True,
+    'automod_ignore_level': 2,
+    'automod_minimal_membercount_trust_server': 0,
+    'automod_note_message_deletions': False,
+    'automod_multiplictor_offline': 0.2,
+    'automod_multiplictor_new_account': 0.4,
+    'automod_multiplictor_just_joined': 0.5,
+    'automod_multiplictor_have_nitro': -0.5,
+    'automod_multiplictor_have_roles': -0.6,
+    'automod_multiplictor_bot_banned': 0.5,
+    'automod_score_caps': 0.5,
+    'automod_score_embed': 1,
+    'automod_score_everyone': 1,
+    'automod_score_too_many_mentions': 1,
+    'automod_score_contain_invites': 2.5,
+    'automod_score_repeated': 0.5,
+    'automod_score_bad_words': 0.5,
+    'automod_score_multimessage_too_many_mentions': 2,
+    'automod_score_multimessage_too_many_users_mentions': 2,
+    'automod_score_zalgo': 3,
+    'automod_delete_message_score': 2,
+    'automod_warn_score': 3,
+    'automod_kick_score': 5,
+    'automod_softban_score': 0,
+    'automod_ban_score': 10,
+    'autotrigger_enable': True,
+    'autotrigger_badstrings_score': 10,
+    'autotrigger_libradiscordbots_score': 10,
+    'autotrigger_sexdatingdiscordbots_score': 10,
+    'autotrigger_instantessaydiscordbots_score': 10,
+    'autotrigger_sexbots_score': 10,
+}
+
+DEFAULT_AVATAR_URL = "https://cdn.discordapp.com/embed/avatars/1.png"
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+
+class FakeMember:
+    def __init__(self, member_id: int, guild: 'FakeGuild', name: str = None, new: bool = False, roles: int = 1):
+        now = datetime.datetime.now()
+        self.id = member_id
+        self.guild = guild
+        self.name = name or f"User{member_id}"
+        self.discriminator = f"{member_id % 10000:04d}"
+        self.bot = False
+        self.status = discord.Status.online
+        self.created_at = now - datetime.timedelta(days=1 if new else 400)
+        self.joined_at = now - datetime.timedelta(hours=1 if new else 24 * 100)
+        self.roles = [FakeRole(guild.id)] + [FakeRole(guild.id + i) for i in range(1, roles)]
+        self.avatar = None if new else f"{member_id:032x}"
+        self.avatar_url = DEFAULT_AVATAR_URL if new else f"https://cdn.discordapp.com/avatars/{member_id}/{self.avatar}.png"
+        self.default_avatar_url = DEFAULT_AVATAR_URL
+        self.guild_permissions = discord.Permissions.none()
+        self.mention = f"<@{member_id}>"
+
+    def is_avatar_animated(self) -> bool:
+        return False
+
+    def permissions_in(self, channel) -> discord.Permissions:
+        return discord.Permissions.all()
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"Guild {guild_id}"
+        self.member_count = 1000
+        self.owner_id = guild_id + 1
+        self.owner = FakeMember(self.owner_id, self)
+        self.me = FakeMember(BOT_USER_ID, self)
+        self.roles = []
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: FakeGuild, topic: str = ""):
+        self.id = channel_id
+        self.name = f"channel-{channel_id}"
+        self.guild = guild
+        self.topic = topic
+        self.type = discord.ChannelType.text
+
+    def permissions_for(self, member) -> discord.Permissions:
+        return discord.Permissions.all()
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, content: str, author: FakeMember, channel: FakeChannel, mentions: typing.List[FakeMember] = ()):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.mentions = list(mentions)
+        self.mention_everyone = False
+        self.attachments = []
+        self.embeds = []
+
+
+class FakeInvite:
+    def __init__(self, code: str, guild_id: int, member_count: int):
+        self.code = code
+        self.guild = FakeGuild(guild_id)
+        self.approximate_member_count = member_count
+
+
+class FakeContext:
+    def __init__(self, bot: 'FakeBot', message: FakeMessage):
+        self.bot = bot
+        self.message = message
+        self.guild = message.guild
+        self.channel = message.channel
+        self.author = message.author
+        self.logger = bot.logger
+
+
+class FakeApi:
+    def __init__(self):
+        self.calls = collections.Counter()
+
+    async def get_settings(self, guild) -> dict:
+        self.calls['get_settings'] += 1
+        return dict(DEFAULT_SETTINGS)
+
+
+class FakeBot:
+    def __init__(self):
+        self.logger = logging.getLogger("benchmark")
+        self.base_logger = self.logger
+        self.user = discord.Object(id=BOT_USER_ID)
+        self.cache = Cache(self)
+        self.api = FakeApi()
+        self.settings = Settings(self)
+        self.fetched_invites = 0
+
+    async def wait_until_ready(self):
+        return
+
+    async def get_context(self, message, cls=None):
+        return FakeContext(self, message)
+
+    async def fetch_invite(self, code: str, with_counts: bool = False):
+        self.fetched_invites += 1
+        await asyncio.sleep(0)
+        return FakeInvite(code, guild_id=hash(code) % 10 ** 17, member_count=50)
+
+
+SCENARIOS = {
+    'plain': [
+        "hey everyone, how is it going?",
+        "Did anyone see the new episode last night? It was absolutely insane, I can't wait for next week",
+        "I'll be there in 5 minutes, wait for me",
+        "Can a moderator check #general please, someone is spamming",
+        "Bonjour à tous, ça va ? On se retrouve où ce soir ?",
+        "GG 🎉🎉 well played everyone 👏",
+    ],
+    'caps': [
+        "WHY IS NOBODY ANSWERING ME THIS IS RIDICULOUS",
+        "STOP SPAMMING THE CHANNEL PLEASE",
+    ],
+    'invites': [
+        "join my server discord.gg/abcdef1234 it's the best",
+        "free nitro at discord.gg/FreeNitro2024 and discordapp.com/invite/OtherServer",
+    ],
+    'mentions': [
+        "{mentions} come here",
+        "{mentions} look at this!!",
+    ],
+    'zalgo': [
+        "h̸̡̪̯ͨ͊̽̅̾̎Ȩ̬̩̾͛ͪ̈́̀́͘ ̶̧̨̱̹̭̯ͧ̾ͬC̷̙̲̝͖ͭ̏ͥͮ͟Oͮ͏̮̪̝͍M̲̖͊̒ͪͩͬ̚̚͜Ȇ̴̟̟͙̞ͩ͌͝S̨̥̫͎̭ͯ̿̔̀ͅ",
+        "Z̤͔ͧ̑̓ä͖̭̈̇lͮ̒ͫǧ̗͚̚o̙̔ͮ̇͐̇ text is a̴̡̛ ̷p̸a̵i̶n̷",
+    ],
+    'triggers': [
+        "Ethereum 2.0 Airdrop is live! worked for me so its legit https://etherairdrop.io/",
+        "My 18+ photos - https://www.nakedphotos.club/",
+        "Instant Essay Writing Service! Order essay writing online! Best Prices - Best Writers ! write-some.ga",
+    ],
+    'bad_words': [
+        "what the fuck is going on",
+        "this is such a dick move",
+    ],
+}
+
+
+def build_synthetic_messages(count: int, guilds_count: int, seed: int = 42) -> typing.List[typing.Tuple[str, FakeMessage]]:
+    rng = random.Random(seed)
+    guilds = [FakeGuild(100000 + i * 1000) for i in range(guilds_count)]
+    channels = [FakeChannel(guild.id + 500, guild) for guild in guilds]
+    authors = {guild.id: [FakeMember(guild.id * 1000 + i, guild, new=(i % 10 == 0)) for i in range(200)] for guild in guilds}
+
+    weights = {'plain': 80, 'caps': 4, 'invites': 4, 'mentions': 3, 'zalgo': 2, 'triggers': 4, 'bad_words': 3}
+    scenarios = list(weights.keys())
+
+    messages = []
+    for i in range(count):
+        channel = rng.choice(channels)
+        guild = channel.guild
+        author = rng.choice(authors[guild.id])
+        scenario = rng.choices(scenarios, weights=[weights[s] for s in scenarios])[0]
+        content = rng.choice(SCENARIOS[scenario])
+        mentions = []
+
+        if scenario == 'mentions':
+            mentions = rng.sample(authors[guild.id], 6)
+            content = content.format(mentions=" ".join(m.mention for m in mentions))
+
+        messages.append((scenario, FakeMessage(i, content, author, channel, mentions)))
+
+    return messages
+
+
+def load_recorded_messages(path: str) -> typing.List[typing.Tuple[str, FakeMessage]]:
+    guilds = {}
+    channels = {}
+    members = {}
+
+    def get_member(member_id: int, guild: FakeGuild) -> FakeMember:
+        if (guild.id, member_id) not in members:
+            members[(guild.id, member_id)] = FakeMember(member_id, guild)
+        return members[(guild.id, member_id)]
+
+    messages = []
+    with open(path, "r") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+
+            guild_id = record.get("guild_id", 100000)
+            if guild_id not in guilds:
+                guilds[guild_id] = FakeGuild(guild_id)
+            guild = guilds[guild_id]
+
+            channel_id = record.get("channel_id", guild_id + 500)
+            if channel_id not in channels:
+                channels[channel_id] = FakeChannel(channel_id, guild, topic=record.get("channel_topic", ""))
+
+            author = get_member(record.get("author_id", 1), guild)
+            mentions = [get_member(m, guild) for m in record.get("mentions", [])]
+
+            messages.append((record.get("scenario", "recorded"),
+                             FakeMessage(record.get("id", i), record["content"], author, channels[channel_id], mentions)))
+
+    return messages
+
+
+def percentiles(latencies: typing.List[float]) -> typing.Tuple[float, float]:
+    latencies = sorted(latencies)
+    p50 = latencies[int(0.50 * (len(latencies) - 1))]
+    p99 = latencies[int(0.99 * (len(latencies) - 1))]
+    return p50, p99
+
+
+async def time_checks(cog: AutoMod, bot: FakeBot, messages: typing.List[typing.Tuple[str, FakeMessage]]) -> typing.Dict[str, float]:
+    """
+    Time the main checks on their own, to see where check_message spends its time.
+    """
+    costs = {}
+
+    async def measure(name: str, coroutine_function):
+        start = time.perf_counter()
+        for _, message in messages:
+            await coroutine_function(message)
+        costs[name] = (time.perf_counter() - start) / len(messages)
+
+    async def invites(message):
+        policy = await bot.settings.get_automod_policy(message.guild)
+        await cog.get_invites_count(CheckMessage(bot, message, policy))
+
+    async def triggers(message):
+        policy = await bot.settings.get_automod_policy(message.guild)
+        enabled_triggers = await get_enabled_triggers(CheckMessage(bot, message, policy))
+        TRIGGERS_PHRASES_MATCHER.scan(message.content, [type(t) for t in enabled_triggers])
+
+    async def level(message):
+        await get_level(FakeContext(bot, message), message.author)
+
+    await measure("get_automod_policy", lambda message: bot.settings.get_automod_policy(message.guild))
+    await measure("get_level", level)
+    await measure("get_invites_count", invites)
+    await measure("get_bad_word_matches", lambda message: bot.settings.get_bad_word_matches(message.guild, message.content))
+    await measure("contains_zalgo", lambda message: cog.contains_zalgo(message.content))
+    await measure("autotriggers phrases scan", triggers)
+
+    return costs
+
+
+async def run(messages: typing.List[typing.Tuple[str, FakeMessage]], warmup: int):
+    bot = FakeBot()
+    cog = AutoMod(bot)
+
+    # Warm the settings and invites caches, like on a bot that has been running for a while
+    for _, message in messages[:warmup]:
+        await cog.check_message(message, act=False)
+
+    latencies = collections.defaultdict(list)
+    start = time.perf_counter()
+
+    for scenario, message in messages:
+        message_start = time.perf_counter()
+        await cog.check_message(message, act=False)
+        latencies[scenario].append(time.perf_counter() - message_start)
+
+    elapsed = time.perf_counter() - start
+    costs = await time_checks(cog, bot, messages)
+
+    print(f"{len(messages)} messages checked in {elapsed:.2f}s: {len(messages) / elapsed:.0f} messages/s")
+    print(f"API calls: {dict(bot.api.calls)}, invites fetched: {bot.fetched_invites}")
+    print()
+    print(f"{'scenario':<12} {'count':>7} {'mean µs':>9} {'p50 µs':>9} {'p99 µs':>9}")
+    all_latencies = []
+    for scenario, scenario_latencies in sorted(latencies.items()):
+        all_latencies.extend(scenario_latencies)
+        p50, p99 = percentiles(scenario_latencies)
+        print(f"{scenario:<12} {len(scenario_latencies):>7} {statistics.mean(scenario_latencies) * 1e6:>9.1f} {p50 * 1e6:>9.1f} {p99 * 1e6:>9.1f}")
+    p50, p99 = percentiles(all_latencies)
+    print(f"{'all':<12} {len(all_latencies):>7} {statistics.mean(all_latencies) * 1e6:>9.1f} {p50 * 1e6:>9.1f} {p99 * 1e6:>9.1f}")
+    print()
+    print("Per check cost (mean over all messages):")
+    for name, cost in costs.items():
+        print(f"  {name:<28} {cost * 1e6:>9.1f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AutoMod.check_message offline.")
+    parser.add_argument("--messages", type=int, default=20000, help="Number of synthetic messages to check")
+    parser.add_argument("--guilds", type=int, default=20, help="Number of guilds the synthetic messages are spread on")
+    parser.add_argument("--replay", type=str, default=None, help="JSON lines file of recorded messages to replay instead")
+    parser.add_argument("--warmup", type=int, default=1000, help="Messages checked before measuring")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.getLogger("benchmark").addHandler(logging.NullHandler())
+
+    if args.replay:
+        messages = load_recorded_messages(args.replay)
+    else:
+        messages = build_synthetic_messages(args.messages, args.guilds, seed=args.seed)
+
+    asyncio.get_event_loop().run_until_complete(run(messages, warmup=min(args.warmup, len(messages))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of the AutoMod zalgo detection.
+
+Compares cogs.helpers.zalgo.zalgo_score with the previous implementation (unicodedata.category on every character, then
+numpy.percentile) on a corpus of realistic messages, and checks that both give the same results.
+
+Run it from the repository root with
+> python -m benchmarks.zalgo
+"""
+import random
+import time
+import unicodedata
+
+try:
+    # noinspection PyUnresolvedReferences
+    import numpy
+except ImportError:
+    numpy = None
+
+from cogs.helpers.zalgo import zalgo_score, percentile
+
+ITERATIONS = 20
+
+PLAIN_MESSAGES = [
+    "hey everyone, how is it going?",
+    "lol",
+    "Did anyone see the new episode last night? It was absolutely insane, I can't wait for next week",
+    "ok",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "I'll be there in 5 minutes, wait for me",
+    "GG WP",
+    "Can a moderator check #general please, someone is spamming",
+]
+
+ACCENTED_MESSAGES = [
+    "Bonjour à tous, ça va ? On se retrouve où ce soir ?",
+    "¿Dónde está la biblioteca? Necesito estudiar para el exámen",
+    "Tiếng Việt có dấu là một ngôn ngữ rất đẹp",
+    "नमस्ते, आप कैसे हैं?",
+]
+
+EMOJI_MESSAGES = [
+    "😂😂😂 that's so funny",
+    "GG 🎉🎉 well played everyone 👏",
+    "🇫🇷 vs 🇧🇪 tonight, who's watching? ⚽",
+]
+
+
+def make_zalgo(text: str, intensity: int, rng: random.Random) -> str:
+    marks = [chr(c) for c in range(0x0300, 0x036F)]
+    return "".join(c + "".join(rng.choice(marks) for _ in range(rng.randint(0, intensity))) for c in text)
+
+
+def build_corpus(size: int = 10000, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        kind = rng.random()
+        if kind < 0.8:
+            corpus.append(rng.choice(PLAIN_MESSAGES))
+        elif kind < 0.9:
+            corpus.append(rng.choice(ACCENTED_MESSAGES))
+        elif kind < 0.97:
+            corpus.append(rng.choice(EMOJI_MESSAGES))
+        else:
+            corpus.append(make_zalgo(rng.choice(PLAIN_MESSAGES), rng.randint(1, 10), rng))
+    return corpus
+
+
+def old_zalgo_score(message: str):
+    """
+    The implementation zalgo_score replaced, kept here as a reference.
+    """
+    THRESHOLD = 0.5
+    if len(message) == 0:
+        return False, 0
+    word_scores = []
+    for word in message.split():
+        cats = [unicodedata.category(c) for c in word]
+        score = sum([cats.count(banned) for banned in ['Mn', 'Me']]) / len(word)
+        word_scores.append(score)
+    if numpy is not None:
+        total_score = numpy.percentile(word_scores, 75)
+    else:
+        total_score = percentile(word_scores, 75)
+    contain = total_score > THRESHOLD
+    return contain, total_score
+
+
+def bench(func, corpus: list) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for message in corpus:
+            func(message)
+    return (time.perf_counter() - start) / (ITERATIONS * len(corpus))
+
+
+def main():
+    corpus = build_corpus()
+
+    for message in corpus:
+        old_contain, old_score = old_zalgo_score(message)
+        new_contain, new_score = zalgo_score(message)
+        assert old_contain == new_contain and abs(old_score - new_score) < 1e-9, f"Results differ for {message!r}"
+
+    old = bench(old_zalgo_score, corpus)
+    new = bench(zalgo_score, corpus)
+
+    print(f"{len(corpus)} messages, {ITERATIONS} iterations (reference percentile: {'numpy' if numpy is not None else 'python'})")
+    print(f"old: {old * 1e6:.2f} µs/message")
+    print(f"new: {new * 1e6:.2f} µs/message ({old / new:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
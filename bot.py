@@ -108,6 +108,8 @@ finally:
     bot.loop.run_until_complete(bot.change_presence(status=discord.Status.dnd, activity=game))
 
     bot.loop.run_until_complete(bot.logout())
+    bot.loop.run_until_complete(bot.actions_queue.stop())
+    bot.loop.run_until_complete(bot.api.close())
 
     bot.loop.run_until_complete(asyncio.sleep(3))
     bot.loop.close()
@@ -1,4 +1,3 @@
-import collections
 import datetime
 
 import discord
@@ -8,6 +7,7 @@ from discord.ext import commands
 
 from cogs.helpers.actions import full_process, softban, ban
 from cogs.helpers.helpful_classes import LikeUser
+from cogs.helpers.joins_window import JoinsWindow, record_join
 
 if typing.TYPE_CHECKING:
     from cogs.helpers.GetBeaned import GetBeaned
@@ -16,23 +16,22 @@ if typing.TYPE_CHECKING:
 class AntiRaid(commands.Cog):
     def __init__(self, bot: 'GetBeaned'):
         self.bot = bot
-        self.join_history = self.bot.cache.get_cache("antiraid_recently_joined", expire_after=600, default=lambda: collections.deque(maxlen=14))
-        self.acted_on = self.bot.cache.get_cache("antiraid_acted_on", expire_after=1200, default=list)
+        self.acted_on = self.bot.cache.get_cache("antiraid_acted_on", expire_after=1200, default=set)
 
-    async def check_same_avatar(self, members, min_number_of_same_avatar: int = 3, ignore_no_avatar: bool = True) -> typing.List[discord.Member]:
-        counts = collections.defaultdict(lambda: [0, []])
-        for member in members:
-            member: discord.Member
-            if member.avatar is not None and ignore_no_avatar:
-                counts[member.avatar][0] += 1
-                counts[member.avatar][1].append(member)
+    async def check_same_avatar(self, window: JoinsWindow, member: discord.Member, min_number_of_same_avatar: int = 3) -> typing.List[discord.Member]:
+        """
+        Members of the joins window sharing the avatar of a new member, if there are enough of them.
 
-        flagged = []
-        for count in counts.values():
-            if count[0] >= min_number_of_same_avatar:
-                flagged.extend(count[1])
+        Only the cluster of the new member can have grown, the others were already checked when their members joined.
+        """
+        if member.avatar is None:
+            return []
 
-        return flagged
+        same_avatar = window.with_avatar(member.avatar)
+        if len(same_avatar) >= min_number_of_same_avatar:
+            return same_avatar
+        else:
+            return []
 
     async def sanity_check(self, members: typing.List[discord.Member]) -> typing.List[discord.Member]:
         bad_members = []
@@ -41,20 +40,14 @@ class AntiRaid(commands.Cog):
                 bad_members.append(member)
         return bad_members
 
-    async def add_to_history(self, member: discord.Member):
-        if member not in self.join_history[member.guild]:
-            self.join_history[member.guild].append(member)
-            self.join_history.reset_expiry(member.guild)
-            self.acted_on.reset_expiry(member.guild)
-            return True
-        else:
-            return False  # Already checked this guy.
-
-    async def get_history(self, guild: discord.Guild):
-        return self.join_history[guild]
+    async def add_to_history(self, member: discord.Member) -> JoinsWindow:
+        window = record_join(self.bot, member)
+        self.acted_on.reset_expiry(member.guild)
+        return window
 
     async def remove_already_acted_on(self, guild: discord.Guild, members: typing.Iterable[discord.Member]) -> typing.List[discord.Member]:
-        return list(set(members) - set(self.acted_on[guild]))
+        acted_on = self.acted_on[guild]
+        return [member for member in members if member.id not in acted_on]
 
     async def run_actions(self, guild: discord.Guild, bad_members: typing.List[discord.Member]):
         if len(bad_members) == 0:
@@ -93,25 +86,22 @@ class AntiRaid(commands.Cog):
                 await full_process(self.bot, ban, member, autoinspect_user, reason=f"Automatic ban by AutoInspect AntiRaid")
                 return False
 
-    async def run_guild_checks(self, guild: discord.Guild):
+    async def run_guild_checks(self, guild: discord.Guild, member: discord.Member, window: JoinsWindow):
         if not await self.bot.settings.get(guild, 'autoinspect_enable'):
             return 'AutoInspect disabled on this guild.'
 
-        history = await self.get_history(guild)
-        bad_avatar = await self.check_same_avatar(history)
+        bad_avatar = await self.check_same_avatar(window, member)
         bad_members = await self.remove_already_acted_on(guild, bad_avatar)
         bad_members = await self.sanity_check(bad_members)
 
-        self.acted_on[guild]: list
-
-        self.acted_on[guild].extend(bad_members)
+        self.acted_on[guild].update(member.id for member in bad_members)
         self.acted_on.reset_expiry(guild)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         await self.bot.wait_until_ready()
-        await self.add_to_history(member)
-        await self.run_guild_checks(member.guild)
+        window = await self.add_to_history(member)
+        await self.run_guild_checks(member.guild, member, window)
 
 
 def setup(bot: 'GetBeaned'):
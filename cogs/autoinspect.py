@@ -13,6 +13,11 @@ if typing.TYPE_CHECKING:
 from cogs.helpers.helpful_classes import LikeUser
 from cogs.helpers.actions import full_process, softban, ban, kick
 from cogs.helpers.context import CustomContext
+from cogs.helpers.joins_window import record_join
+
+# Protection mode is enabled when that many members joined in the last MASSJOINS_WINDOW seconds
+MASSJOINS_THRESHOLD = 15
+MASSJOINS_WINDOW = 60
 
 
 class AutoInspect(commands.Cog):
@@ -28,7 +33,6 @@ class AutoInspect(commands.Cog):
                        'autoinspect_bitcoin_bots': self.bitcoin_bots_check,
                        'autoinspect_suspicious': self.suspicious_check,}
         self.bypass_cache = bot.cache.get_cache("autoinspect_bypass_cache", expire_after=600, strict=True)
-        self.joins_cache = bot.cache.get_cache("massjoins_cache", expire_after=60, strict=True)
         self.protected_cache = bot.cache.get_cache("massjoins_protected", expire_after=300, strict=True)
 
     async def suspicious_check(self, member: discord.Member) -> bool:
@@ -147,13 +151,13 @@ class AutoInspect(commands.Cog):
             'guild': member.guild,
         }
 
-        await self.massjoins(member)
+        await self.massjoins(member, logging_channel)
 
         for check_name, check_callable in self.checks.items():
             if not await self.check_and_act(check_callable, check_name, context):
                 return True
 
-    async def massjoins(self, member: discord.Member):
+    async def massjoins(self, member: discord.Member, logging_channel: discord.TextChannel = None):
         guild = member.guild
 
         if not await self.bot.settings.get(guild, 'autoinspect_enable') or not await self.bot.settings.get(guild, 'autoinspect_massjoins'):
@@ -161,20 +165,27 @@ class AutoInspect(commands.Cog):
 
         autoinspect_user = LikeUser(did=4, name="AutoInspector", guild=guild)
 
-        self.joins_cache[guild] = (self.joins_cache.get(guild, []) + [member])[:]
-        joins_count = len(self.joins_cache[guild])
+        window = record_join(self.bot, member)
+        joins_count = window.count(MASSJOINS_WINDOW)
 
         if self.protected_cache.get(guild, False):
-            await full_process(self.bot, kick, member, autoinspect_user, reason=f"Automatic kick by AutoInspect because of too many joins",
-                               automod_logs=f"{joins_count} joins on the server in the last minutes... Please try joining later...")
+            await self.bot.mass_actions.run(guild, kick, [member], autoinspect_user, reason=f"Automatic kick by AutoInspect because of too many joins",
+                                            automod_logs=f"{joins_count} joins on the server in the last minutes... Please try joining later...")
             return
         else:
-            if joins_count >= 15:
+            if joins_count >= MASSJOINS_THRESHOLD:
                 self.protected_cache[guild] = True
-                tokick = self.joins_cache[guild]
-                for member in tokick:
-                    await full_process(self.bot, kick, member, autoinspect_user, reason=f"Automatic kick by AutoInspect because of too many joins",
-                                       automod_logs=f"{joins_count} joins on the server in the last minutes... Please try joining later...")
+                tokick = [m for m in window.members_since(MASSJOINS_WINDOW) if not m.bot]
+                report = await self.bot.mass_actions.run(guild, kick, tokick, autoinspect_user, reason=f"Automatic kick by AutoInspect because of too many joins",
+                                                         automod_logs=f"{joins_count} joins on the server in the last minutes... Please try joining later...")
+
+                throughput = f"{report['throughput']:.1f} kicks/s" if report['throughput'] else "n/a"
+                self.bot.logger.info(f"Massjoins on {guild.id}: kicked {report['acted']} members in {report['elapsed']:.1f}s ({throughput}), "
+                                     f"{report['failed']} failed, {report['skipped']} already kicked")
+
+                if logging_channel:
+                    await logging_channel.send(f"AutoInspect massjoins: {report['acted']} members kicked in {report['elapsed']:.1f}s ({throughput}), "
+                                               f"{report['failed']} failed. New members will be kicked for the next 5 minutes.")
 
 
 def setup(bot: 'GetBeaned'):
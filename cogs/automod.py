@@ -1,13 +1,10 @@
-import collections
 import datetime
 import logging
 import re
 import typing
-import unicodedata
 from typing import Union
 
 import discord
-import numpy
 
 if typing.TYPE_CHECKING:
     from cogs.helpers.GetBeaned import GetBeaned
@@ -17,21 +14,39 @@ from discord.ext import commands
 
 from cogs.helpers import checks, context
 from cogs.helpers.actions import full_process, note, warn, kick, softban, ban
+from cogs.helpers.attachments import AttachmentsHasher, ATTACHMENTS_REPEATED_AUTHORS
+from cogs.helpers.duplicate_content import record_content, DUPLICATE_CONTENT_AUTHORS
+from cogs.helpers.guild_settings import AutomodPolicy
 from cogs.helpers.helpful_classes import LikeUser
+from cogs.helpers.invites import InviteResolver
 from cogs.helpers.level import get_level
-from cogs.helpers.triggers import SexDatingDiscordBots, InstantEssayDiscordBots, SexBots, LibraCryptoDiscordBots, BadStrings, DMMeNudesDiscordBots
+from cogs.helpers.message_history import MessageRecord, get_messages_history
+from cogs.helpers.pipeline import MessagesPipeline
+from cogs.helpers.topic_flags import get_topic_flags
+from cogs.helpers.zalgo import zalgo_score
+from cogs.helpers.triggers import SexDatingDiscordBots, InstantEssayDiscordBots, SexBots, LibraCryptoDiscordBots, BadStrings, DMMeNudesDiscordBots, \
+    TriggersPhrasesMatcher, AutoTrigger
 from cogs.helpers.context import CustomContext
 
-ZALGO_CHAR_CATEGORIES = ['Mn', 'Me']
 DEBUG = False
 
 TRIGGERS_ENABLED = [BadStrings, LibraCryptoDiscordBots, SexDatingDiscordBots, InstantEssayDiscordBots, SexBots, DMMeNudesDiscordBots]
+TRIGGERS_PHRASES_MATCHER = TriggersPhrasesMatcher(TRIGGERS_ENABLED)
+
+
+async def get_enabled_triggers(check_message: 'CheckMessage') -> typing.List[AutoTrigger]:
+    """
+    The triggers enabled in the message guild, so that the message is only scanned for their phrases.
+    """
+    triggers = [t(check_message) for t in TRIGGERS_ENABLED]
+    return [t for t in triggers if await t.is_enabled()]
 
 
 class CheckMessage:
-    def __init__(self, bot: 'GetBeaned', message: discord.Message):
+    def __init__(self, bot: 'GetBeaned', message: discord.Message, policy: AutomodPolicy):
         self.bot = bot
         self.message = message
+        self.policy = policy
         self.multiplicator = 1
         self.score = 0
 
@@ -42,6 +57,9 @@ class CheckMessage:
 
         self.invites = []
 
+        # AutoTrigger -> number of its phrases found in the message, see TriggersPhrasesMatcher
+        self.phrases_hits: typing.Optional[typing.Dict[type, int]] = None
+
         self.debug(f"MESSAGE : {message.content:.100} (on #{message.channel.name})")
 
     @property
@@ -100,27 +118,18 @@ class AutoMod(commands.Cog):
                 ((?!.*[Ii10OolL]).[a-zA-Z0-9]{5,12}|[a-zA-Z0-9\-]{2,32}) # Rest of the fucking owl.
                 """, flags=re.VERBOSE)
 
-        # self.message_history = collections.defaultdict(
-        #    lambda: collections.deque(maxlen=7))  # Member -> collections.deque(maxlen=7)
+        self.message_history = get_messages_history(bot)
+        self.attachments_hasher = AttachmentsHasher(bot)
 
-        self.message_history = bot.cache.get_cache("automod_previous_messages", expire_after=600, default=lambda: collections.deque(maxlen=7))
+        self.invites_resolver = InviteResolver(bot)
 
-        self.invites_codes_cache = bot.cache.get_cache("automod_invites_codes", expire_after=3600)
+        self.automod_cache = bot.cache.get_cache("automod_logs", expire_after=3600, max_entries=200000, max_bytes=128 * 1024 * 1024, eviction_policy="ttl")
 
-        self.automod_cache = bot.cache.get_cache("automod_logs", expire_after=3600)
+        # Messages are checked by a fixed number of workers per shard, not as soon as they are received
+        self.pipeline = MessagesPipeline(bot, self.process_message)
 
     async def contains_zalgo(self, message: str):
-        THRESHOLD = 0.5
-        if len(message) == 0:
-            return False, 0
-        word_scores = []
-        for word in message.split():
-            cats = [unicodedata.category(c) for c in word]
-            score = sum([cats.count(banned) for banned in ZALGO_CHAR_CATEGORIES]) / len(word)
-            word_scores.append(score)
-        total_score = numpy.percentile(word_scores, 75)
-        contain = total_score > THRESHOLD
-        return contain, total_score
+        return zalgo_score(message)
 
     async def get_invites(self, message: str) -> typing.List[str]:
         #  message = message.lower() -- Don't do that, invites are Case Sensitive :x
@@ -137,42 +146,36 @@ class AutoMod(commands.Cog):
             return 0
         else:
             total = 0
-            for invite in invites:
+            records = await self.invites_resolver.resolve_many(invites)
+            for invite, record in records.items():
                 check_message.debug(f"Checking invite code : {invite}")
 
-                invite_obj = self.invites_codes_cache.get(invite, None)
-                try:
-                    if invite_obj is None:
-                        print(f"Checking invite code : {invite}")
-                        invite_obj = await self.bot.fetch_invite(invite, with_counts=True)
-                    self.invites_codes_cache[invite] = invite_obj
-                    if invite_obj.guild.id not in [195260081036591104, 449663867841413120, 512328935304855555] + [check_message.message.guild.id]:
-                        minimal_membercount = await self.bot.settings.get(check_message.message.guild, 'automod_minimal_membercount_trust_server')
-
-                        try:
-                            member_count = invite_obj.approximate_member_count
-                        except AttributeError:
-                            member_count = 0
-                        if 0 < minimal_membercount < member_count:
-                            check_message.debug(
-                                f">> Detected invite code for untrusted server but known enough not to act on it (approx. members count: {member_count}): "
-                                f"{invite_obj.code} (server : {invite_obj.guild.name} - {invite_obj.guild.id})")
-                        else:
-                            check_message.debug(
-                                f">> Detected invite code for untrusted server (approx. members count: {member_count}): "
-                                f"{invite_obj.code} (server : {invite_obj.guild.name} - {invite_obj.guild.id})")
-
-                            check_message.invites.append(invite_obj)
-                            total += 1
-                    else:
-                        check_message.debug(f">> Detected invite code for trusted server:"
-                                            f"{invite_obj.code}")
-                except discord.errors.NotFound:
-                    self.invites_codes_cache[invite] = None
+                if isinstance(record, Exception):
+                    check_message.debug(f">> Couldn't check the invite code: {record!r}")
+                    continue
+                elif record is None:
                     check_message.debug(f">> Invalid invite code")
-
                     continue
 
+                if record.guild_id not in [195260081036591104, 449663867841413120, 512328935304855555] + [check_message.message.guild.id]:
+                    minimal_membercount = check_message.policy.minimal_membercount_trust_server
+                    member_count = record.member_count
+
+                    if 0 < minimal_membercount < member_count:
+                        check_message.debug(
+                            f">> Detected invite code for untrusted server but known enough not to act on it (approx. members count: {member_count}): "
+                            f"{record.code} (server : {record.guild_name} - {record.guild_id})")
+                    else:
+                        check_message.debug(
+                            f">> Detected invite code for untrusted server (approx. members count: {member_count}): "
+                            f"{record.code} (server : {record.guild_name} - {record.guild_id})")
+
+                        check_message.invites.append(record)
+                        total += 1
+                else:
+                    check_message.debug(f">> Detected invite code for trusted server:"
+                                        f"{record.code}")
+
             return total
 
     @commands.command()
@@ -205,63 +208,51 @@ class AutoMod(commands.Cog):
         if message.guild is None:
             return "Not in a guild"  # ignore messages from PMs
 
-        if not await self.bot.settings.get(message.guild, 'automod_enable') and not "[getbeaned:enable_automod]" in str(message.channel.topic):
+        policy = await self.bot.settings.get_automod_policy(message.guild)
+        topic_flags = get_topic_flags(self.bot, message.channel)
+
+        if not policy.enabled and not topic_flags.enable_automod:
             return "Automod disabled here"
 
-        if "[getbeaned:disable_automod]" in str(message.channel.topic):
+        if topic_flags.disable_automod:
             return "`[getbeaned:disable_automod]` in topic, Automod Disabled here"
 
-        current_permissions = message.guild.me.permissions_in(message.channel)
-        wanted_permissions = discord.permissions.Permissions.none()
-        wanted_permissions.update(
-            kick_members=True,
-            ban_members=True,
-            read_messages=True,
-            send_messages=True,
-            manage_messages=True,
-            embed_links=True,
-            attach_files=True,
-            read_message_history=True,
-            external_emojis=True,
-            change_nickname=True
-        )
-
-        cond = current_permissions >= wanted_permissions
+        cond = checks.bot_can(self.bot, message.channel, checks.MODERATION_PERMISSIONS)
 
         if not cond:
             return "No permissions to act"
 
-        check_message = CheckMessage(self.bot, message)
+        check_message = CheckMessage(self.bot, message, policy)
         ctx = await self.bot.get_context(message, cls=context.CustomContext)
 
         author_level = await get_level(ctx, check_message.message.author)
-        automod_ignore_level = await self.bot.settings.get(message.guild, 'automod_ignore_level')
+        automod_ignore_level = policy.ignore_level
 
         if author_level >= automod_ignore_level and act:
             return "Author level is too high, I'm not going further"
 
         if author.status is discord.Status.offline:
-            check_message.multiplicator += await self.bot.settings.get(message.guild, 'automod_multiplictor_offline')
+            check_message.multiplicator += policy.multiplicator_offline
             check_message.debug("Author is offline (probably invisible)")
 
         if author.created_at > datetime.datetime.now() - datetime.timedelta(days=7):
-            check_message.multiplicator += await self.bot.settings.get(message.guild, 'automod_multiplictor_new_account')
+            check_message.multiplicator += policy.multiplicator_new_account
             check_message.debug("Author account is less than a week old")
 
         if author.joined_at > datetime.datetime.now() - datetime.timedelta(days=1):
-            check_message.multiplicator += await self.bot.settings.get(message.guild, 'automod_multiplictor_just_joined')
+            check_message.multiplicator += policy.multiplicator_just_joined
             check_message.debug("Author account joined less than a day ago")
 
         if author.is_avatar_animated():
-            check_message.multiplicator += await self.bot.settings.get(message.guild, 'automod_multiplictor_have_nitro')
+            check_message.multiplicator += policy.multiplicator_have_nitro
             check_message.debug("Author account is nitro'd (or at least I can detect an animated avatar)")
 
         if len(author.roles) > 2:  # Role duckies is given by default
-            check_message.multiplicator += await self.bot.settings.get(message.guild, 'automod_multiplictor_have_roles')
+            check_message.multiplicator += policy.multiplicator_have_roles
             check_message.debug("Author account have a role in the server")
 
         if author_level == 0:
-            check_message.multiplicator += await self.bot.settings.get(message.guild, 'automod_multiplictor_bot_banned')
+            check_message.multiplicator += policy.multiplicator_bot_banned
             check_message.debug("Author is bot-banned")
 
         if check_message.multiplicator <= 0:
@@ -278,7 +269,7 @@ class AutoMod(commands.Cog):
         caps_percentage = total_captial_letters / total_letters if total_letters > 0 else 1
 
         if caps_percentage >= 0.7 and total_letters > 10:
-            check_message.score += await self.bot.settings.get(message.guild, 'automod_score_caps')
+            check_message.score += policy.score_caps
             check_message.debug(f"Message is written in CAPS LOCK (% of caps: {round(caps_percentage * 100, 3)} —"
                                 f" total length: {total_letters})")
 
@@ -287,35 +278,49 @@ class AutoMod(commands.Cog):
         #   check_message.debug(f"Message from a USER contain an EMBED !? (Used to circumvent content blocking)")
 
         if "@everyone" in message.content and not message.mention_everyone:
-            check_message.score += await self.bot.settings.get(message.guild, 'automod_score_everyone')
+            check_message.score += policy.score_everyone
             check_message.debug(
                 f"Message contains an ATeveryone that discord did not register as a ping (failed attempt)")
 
         mentions = set(mention for mention in message.mentions if mention.id != author.id)
 
         if len(mentions) > 3:
-            check_message.score += await self.bot.settings.get(message.guild, 'automod_score_too_many_mentions')
+            check_message.score += policy.score_too_many_mentions
             m_list = [a.name + '#' + a.discriminator for a in mentions]
             check_message.debug(f"Message mentions more than 3 people ({m_list})")
 
-        if "[getbeaned:disable_invite_detection]" not in str(message.channel.topic): # They can add multiple channels separated by a " "
+        if not topic_flags.disable_invite_detection:
             invites_count = await self.get_invites_count(check_message)
             if invites_count >= 1:
-                check_message.score += await self.bot.settings.get(message.guild, 'automod_score_contain_invites') * invites_count
+                check_message.score += policy.score_contain_invites * invites_count
                 check_message.debug(f"Message contains invite(s) ({check_message.invites_code})")
 
-        if message.content and "[getbeaned:disable_spam_detection]" not in str(message.channel.topic):
-            # TODO: Check images repeat
-            repeat = [m.content for m in self.message_history[check_message.message.author]].count(check_message.message.content)
+        if message.content and not topic_flags.disable_spam_detection:
+            repeat = self.message_history[author.id].repeats(check_message.message.content)
             if repeat >= 3:
-                check_message.score += await self.bot.settings.get(message.guild, 'automod_score_repeated') * repeat
+                check_message.score += policy.score_repeated * repeat
                 check_message.debug(f"Message was repeated by the author {repeat} times")
 
+        attachments_hashes = ()
+        if message.attachments and not topic_flags.disable_spam_detection:
+            attachments_hashes = await self.attachments_hasher.hash_message(message)
+
+            repeat = self.message_history[author.id].attachments_repeats(attachments_hashes)
+            if repeat >= 3:
+                check_message.score += policy.score_repeated * repeat
+                check_message.debug(f"Attachment was repeated by the author {repeat} times")
+
+            if act and attachments_hashes and policy.score_duplicate_attachments:
+                authors = self.attachments_hasher.record_in_guild(message.guild, author.id, attachments_hashes)
+                if authors >= ATTACHMENTS_REPEATED_AUTHORS:
+                    check_message.score += policy.score_duplicate_attachments
+                    check_message.debug(f"Attachment was recently sent by {authors} different members of the server")
+
         bad_words_matches = await self.bot.settings.get_bad_word_matches(message.guild, check_message.message.content)
         bad_words_count = len(bad_words_matches)
 
         if bad_words_count >= 1:
-            check_message.score += await self.bot.settings.get(message.guild, 'automod_score_bad_words') * bad_words_count
+            check_message.score += policy.score_bad_words * bad_words_count
             bad_words_list = []
             for match in bad_words_matches:
                 string, pattern = match
@@ -332,37 +337,40 @@ class AutoMod(commands.Cog):
 
         if spam_cond:
             # Not a command or something
-            self.message_history[check_message.message.author].append(check_message.message)  # Add content for repeat-check later.
-            self.message_history.reset_expiry(check_message.message.author)
-
-        if len([mention for mention in message.mentions if mention.id != author.id]):
+            self.message_history[author.id].append(MessageRecord.from_message(check_message.message, attachments_hashes))  # Add content for repeat-check later.
+            self.message_history.reset_expiry(author.id)
 
-            historic_mentions_users = []
+            if message.content and policy.score_duplicate_content and not topic_flags.disable_spam_detection:
+                authors = record_content(self.bot, message)
+                if authors >= DUPLICATE_CONTENT_AUTHORS:
+                    check_message.score += policy.score_duplicate_content
+                    check_message.debug(f"Message was recently sent by {authors} different members of the server")
 
-            for historic_message in self.message_history[check_message.message.author]:
-                historic_mentions_users.extend(mention for mention in historic_message.mentions if mention.id != author.id)
+        if mentions:
+            history = self.message_history[author.id]
 
-            historic_mentions_total = len(historic_mentions_users)
-            historic_mentions_users = set(historic_mentions_users)
-            historic_mentions_different = len(historic_mentions_users)
+            historic_mentions_total = history.mentions_total
+            historic_mentions_users = set(history.mentions)
+            historic_mentions_different = history.mentioned_users
 
             if historic_mentions_total > 7:  # He mentioned 7 times in the last 7 messages
-                check_message.score += await self.bot.settings.get(message.guild, 'automod_score_multimessage_too_many_mentions')
+                check_message.score += policy.score_multimessage_too_many_mentions
                 check_message.debug(f"Message history contains too many mentions (historic_mentions_total={historic_mentions_total})")
 
             if historic_mentions_different > 5:  # He mentioned 5 different users in the last 7 messages
-                check_message.score += await self.bot.settings.get(message.guild, 'automod_score_multimessage_too_many_users_mentions')
+                check_message.score += policy.score_multimessage_too_many_users_mentions
                 check_message.debug(f"Message history contains too many mentions (historic_mentions_different={historic_mentions_different} | users_mentionned: {historic_mentions_users})")
 
         contains_zalgo, zalgo_score = await self.contains_zalgo(message.content)
 
         if contains_zalgo:
-            check_message.score += await self.bot.settings.get(message.guild, 'automod_score_zalgo')
+            check_message.score += policy.score_zalgo
             check_message.debug(f"Message contains zalgo (zalgo_score={zalgo_score})")
 
-        if await self.bot.settings.get(message.guild, 'autotrigger_enable'):
+        if policy.autotrigger_enabled:
             check_message.debug("Running AutoTrigger checks")
-            instancied_triggers = [t(check_message) for t in TRIGGERS_ENABLED]
+            instancied_triggers = await get_enabled_triggers(check_message)
+            check_message.phrases_hits = TRIGGERS_PHRASES_MATCHER.scan(message.content, [type(t) for t in instancied_triggers])
 
             for trigger in instancied_triggers:
                 score = await trigger.run()
@@ -375,14 +383,14 @@ class AutoMod(commands.Cog):
         automod_user = LikeUser(did=1, name="AutoModerator", guild=message.guild)
 
         # Do we need to delete the message ?
-        automod_delete_message_score = await self.bot.settings.get(message.guild, 'automod_delete_message_score')
+        automod_delete_message_score = policy.delete_message_score
         if check_message.total >= automod_delete_message_score > 0:
             check_message.debug(f"Deleting message because score "
                                 f"**{check_message.total}** >= {automod_delete_message_score}")
             try:
                 if act:
                     await message.delete()
-                    if await self.bot.settings.get(message.guild, 'automod_note_message_deletions'):
+                    if policy.note_message_deletions:
                         await full_process(ctx.bot, note, message.author, automod_user, reason="Automod deleted a message from this user.",
                                            automod_logs="\n".join(check_message.logs))
 
@@ -394,10 +402,10 @@ class AutoMod(commands.Cog):
 
         # That's moderation acts, where the bot grabs his BIG HAMMER and throw it in the user face
         # Warning
-        automod_warn_score = await self.bot.settings.get(message.guild, 'automod_warn_score')
-        automod_kick_score = await self.bot.settings.get(message.guild, 'automod_kick_score')
-        automod_softban_score = await self.bot.settings.get(message.guild, 'automod_softban_score')
-        automod_ban_score = await self.bot.settings.get(message.guild, 'automod_ban_score')
+        automod_warn_score = policy.warn_score
+        automod_kick_score = policy.kick_score
+        automod_softban_score = policy.softban_score
+        automod_ban_score = policy.ban_score
 
         # Lets go in descending order:
         if check_message.total >= automod_ban_score > 0:
@@ -439,12 +447,7 @@ class AutoMod(commands.Cog):
         ctx.logger.info("\n".join(check_message.logs))
         return check_message
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        await self.bot.wait_until_ready()
-        if not message.guild:
-            return False  # No PMs
-
+    async def process_message(self, message: discord.Message, edited: bool):
         ret = await self.check_message(message)
 
         try:
@@ -452,22 +455,63 @@ class AutoMod(commands.Cog):
         except AttributeError:
             logs = str(ret)
 
+        if edited:
+            logs = self.automod_cache.get(message.id, "(No logs stored before the edit)") + "\n==AN EDIT WAS MADE==\n" + logs
+
         self.automod_cache[message.id] = logs
 
+    def submit(self, message: discord.Message, edited: bool):
+        if not self.pipeline.submit(message, edited):
+            self.automod_cache[message.id] = "(Not checked: the automod was overloaded and the author is trusted)"
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        await self.bot.wait_until_ready()
+        if not message.guild:
+            return False  # No PMs
+
+        self.submit(message, edited=False)
+
     @commands.Cog.listener()
     async def on_message_edit(self, _: discord.Message, message: discord.Message):
         await self.bot.wait_until_ready()
         if not len(message.content): return
-        ret = await self.check_message(message)
+        if not message.guild:
+            return False  # No PMs
 
-        try:
-            logs = ret.logs_for_discord
-        except AttributeError:
-            logs = str(ret)
+        self.submit(message, edited=True)
 
-        logs = self.automod_cache.get(message.id, "(No logs stored before the edit)") + "\n==AN EDIT WAS MADE==\n" + logs
+    def cog_unload(self):
+        self.pipeline.stop()
+        self.attachments_hasher.close()
 
-        self.automod_cache[message.id] = logs
+    @commands.command()
+    @checks.have_required_level(8)
+    async def automod_pipeline(self, ctx: 'CustomContext'):
+        """
+        Show the automod queues of each shard.
+        """
+        status_message = []
+        for shard_id, shard in sorted(self.pipeline.shards.items()):
+            status = shard.get_status()
+            status_message.append(f"== Shard {shard_id} ==")
+            status_message.append("```diff")
+            status_message.append(f"+ {status['pending']} messages waiting in {status['guilds_pending']} guilds (max {status['max_pending']})")
+            status_message.append(f"+ {status['processed']}/{status['submitted']} messages checked, {status['failed']} failed")
+            status_message.append(f"- {status['shed']} messages shed, {status['dropped']} dropped because the queue was full")
+            status_message.append(f"Waited {round(status['wait_mean'] * 1000)}ms on average, {round(status['wait_p99'] * 1000)}ms p99")
+            status_message.append(f"Checked in {round(status['processing_p50'] * 1000)}ms p50, {round(status['processing_p99'] * 1000)}ms p99")
+            status_message.append("```")
+
+            if sum(map(len, status_message)) > 1500:
+                await ctx.send("\n".join(status_message))
+                status_message = []
+
+        if not self.pipeline.shards:
+            status_message.append("No message was checked yet.")
+
+        if status_message:
+            await ctx.send("\n".join(status_message))
 
 
 def setup(bot: 'GetBeaned'):
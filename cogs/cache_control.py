@@ -1,12 +1,22 @@
+import asyncio
 import typing
 
+import discord
+
 if typing.TYPE_CHECKING:
     from cogs.helpers.GetBeaned import GetBeaned
 
 from discord.ext import tasks, commands
 
 from cogs.helpers import checks
+from cogs.helpers.checks import invalidate_bot_channel_permissions, invalidate_bot_guild_permissions
+from cogs.helpers.cache import CacheStorageDict
 from cogs.helpers.context import CustomContext
+from cogs.helpers.level import invalidate_guild_levels, invalidate_member_level
+from cogs.helpers.topic_flags import get_topic_flags_cache
+
+# How many keys to delete before giving control back to the event loop during a cleanup
+CLEANUP_SLICE_SIZE = 1000
 
 
 class Cache(commands.Cog):
@@ -14,6 +24,18 @@ class Cache(commands.Cog):
         self.bot = bot
         self.housekeeping.start()
 
+    async def cleanup_cache(self, cache_dict: CacheStorageDict) -> int:
+        total_deleted = 0
+
+        while True:
+            deleted = cache_dict.cleanup(max_keys=CLEANUP_SLICE_SIZE)
+            total_deleted += deleted
+
+            if deleted < CLEANUP_SLICE_SIZE:
+                return total_deleted
+
+            await asyncio.sleep(0)
+
     @commands.command()
     @checks.have_required_level(8)
     async def cache_status(self, ctx: 'CustomContext'):
@@ -45,6 +67,15 @@ class Cache(commands.Cog):
             status_message.append("")
             status_message.append("```diff")
             status_message.append(f"+ {status['hits']} requests hit, {status['misses']} requests missed ({pct_misses}%)")
+            if cache_dict.refresh_func is not None:
+                status_message.append(f"+ {status['stale_hits']} stale values served, {status['refreshes']} refreshes "
+                                      f"({status['refresh_failures']} failed)")
+            if cache_dict.eviction is not None:
+                if cache_dict.max_bytes is not None:
+                    status_message.append(f"- {status['evictions']} keys evicted to stay under the size limits "
+                                          f"(~{round(status['stored_bytes'] / 1024)} KiB stored)")
+                else:
+                    status_message.append(f"- {status['evictions']} keys evicted to stay under the size limits")
             status_message.append(f"+ Currently stored keys : {status['stored_keys_count']}")
             status_message.append(f"- Currently stored expired keys : {status['stored_expired_keys_count']}")
             status_message.append(f"Total expired keys : {status['expired_keys_count']}")
@@ -76,8 +107,8 @@ class Cache(commands.Cog):
         message = []
         total_deleted = 0
 
-        for cache_dict_name, cache_dict in self.bot.cache.storage.items():
-            deleted = cache_dict.cleanup()
+        for cache_dict_name, cache_dict in list(self.bot.cache.storage.items()):
+            deleted = await self.cleanup_cache(cache_dict)
             total_deleted += deleted
             message.append(f"{cache_dict_name}: deleted **{deleted}** expired entries")
 
@@ -94,8 +125,8 @@ class Cache(commands.Cog):
         message = []
         total_deleted = 0
 
-        for cache_dict_name, cache_dict in self.bot.cache.storage.items():
-            deleted = cache_dict.cleanup()
+        for cache_dict_name, cache_dict in list(self.bot.cache.storage.items()):
+            deleted = await self.cleanup_cache(cache_dict)
             total_deleted += deleted
             message.append(f"{cache_dict_name}: deleted **{deleted}** expired entries")
 
@@ -103,6 +134,51 @@ class Cache(commands.Cog):
 
         self.bot.logger.info("\n".join(message))
 
+    # Invalidation of the caches that depend on discord objects
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            invalidate_member_level(self.bot, after.guild, after.id)
+            if after.id == self.bot.user.id:
+                invalidate_bot_guild_permissions(self.bot, after.guild)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        invalidate_member_level(self.bot, member.guild, member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.permissions != after.permissions:
+            invalidate_guild_levels(self.bot, after.guild)
+            invalidate_bot_guild_permissions(self.bot, after.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        invalidate_guild_levels(self.bot, role.guild)
+        invalidate_bot_guild_permissions(self.bot, role.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
+        if before.owner_id != after.owner_id:
+            invalidate_guild_levels(self.bot, after)
+            invalidate_bot_guild_permissions(self.bot, after)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        del get_topic_flags_cache(self.bot)[after.id]
+
+        # Overwrites, or the category they are synced with, may have changed
+        if isinstance(after, discord.CategoryChannel):
+            invalidate_bot_guild_permissions(self.bot, after.guild)
+        else:
+            invalidate_bot_channel_permissions(self.bot, after)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        del get_topic_flags_cache(self.bot)[channel.id]
+        invalidate_bot_channel_permissions(self.bot, channel)
+
     @housekeeping.before_loop
     async def before_printer(self):
         await self.bot.wait_until_ready()
@@ -9,10 +9,12 @@ import typing
 from discord.ext import commands as commands
 
 from cogs.helpers import api
+from cogs.helpers.actions_queue import ActionsQueue
 from cogs.helpers import context, checks
 from cogs.helpers.cache import Cache
 from cogs.helpers.converters import NotStrongEnough, HierarchyError
 from cogs.helpers.guild_settings import Settings
+from cogs.helpers.mass_actions import MassActionsExecutor
 
 
 class GetBeaned(commands.AutoShardedBot):
@@ -34,9 +36,12 @@ class GetBeaned(commands.AutoShardedBot):
         self.uptime = datetime.datetime.utcnow()
 
         self.api = api.Api(self)
+        self.actions_queue = ActionsQueue(self)
 
         self.settings = Settings(self)
 
+        self.mass_actions = MassActionsExecutor(self)
+
     async def on_message(self, message):
         self.messages_seen += 1
         if message.author.bot:
@@ -58,6 +63,8 @@ class GetBeaned(commands.AutoShardedBot):
         game = discord.Game(name=f"g+help | g+urls")
         await self.change_presence(status=discord.Status.online, activity=game)
         self.logger.info("We are all set, on_ready was fired! Yeah!")
+        # Send the actions left in the spool by the last run, if any
+        self.actions_queue.start()
         total_members = len(self.users)
         self.logger.info(f"I see {len(self.guilds)} guilds, and {total_members} members")
 
@@ -20,6 +20,9 @@ colours = {'unban': Color.green(),
            'ban': Color.dark_red()
            }
 
+# How long full_process waits for the WebInterface to record an action before acting anyway
+ACTION_RECORDING_TIMEOUT = 3
+
 
 async def thresholds_enforcer(bot, victim: discord.Member, action_type: str):
     if not await bot.settings.get(victim.guild, 'thresholds_enable'):
@@ -127,28 +130,42 @@ async def full_process(bot, action_coroutine: typing.Callable[[discord.Member, s
     """
     A little bit of explanation about what's going on there.
 
-    This is the entry point for action-ing on a `victim`. What this function does is first to POST the action to the
-    WebInterface API, then give the user the URL the link to the specific action got, and ignore if that part fails.
+    This is the entry point for action-ing on a `victim`. What this function does is first to queue the action to be
+    POSTed to the WebInterface API, and wait a little for it to be recorded, to give the user the URL of the action.
+    If the API is too slow, the user gets a link to their profile instead, and we don't wait any longer.
 
-    We then actually act (ban/kick/what_ever) if needed, and finally check for thresholds enforcement (and this may do
-    something else to the user, like kicking/banning him, calling this back).
+    We then actually act (ban/kick/what_ever) if needed, and once the API recorded the action, check for thresholds
+    enforcement (and this may do something else to the user, like kicking/banning him, calling this back).
 
     Lastly, we try to see if we should log messages to a #mod-log channel, and log if wanted to.
     """
 
     action_type = action_coroutine.__name__
 
-    res = await bot.api.add_action(guild=victim.guild,
-                                   user=victim,
-                                   action_type=action_type,
-                                   reason=reason,
-                                   responsible_moderator=moderator,
-                                   attachment=attachement_url,
-                                   automod_logs=automod_logs,
-                                   )
+    recorded = bot.actions_queue.enqueue(guild=victim.guild,
+                                         user=victim,
+                                         action_type=action_type,
+                                         reason=reason,
+                                         responsible_moderator=moderator,
+                                         attachment=attachement_url,
+                                         automod_logs=automod_logs,
+                                         )
+
+    try:
+        res = await asyncio.wait_for(asyncio.shield(recorded), timeout=ACTION_RECORDING_TIMEOUT)
+    except asyncio.TimeoutError:
+        res = None
+    except Exception as e:
+        bot.logger.warning(f"Recording a {action_type} on {victim.id} failed: {e!r}")
+        res = None
+
+    if res is not None:
+        url = "https://getbeaned.me" + res['result_url']
+        case_number = res['case_number']
+    else:
+        url = f"https://getbeaned.me/users/{victim.guild.id}/{victim.id}"
+        case_number = None
 
-    url = "https://getbeaned.me" + res['result_url']
-    case_number = res['case_number']
     quoted_reason = '> '.join(('> ' + reason).splitlines(True))
     victim_message = f"You have received a {action_type}, with the following reason\n" \
                      f"{quoted_reason}\n\n" \
@@ -176,6 +193,31 @@ async def full_process(bot, action_coroutine: typing.Callable[[discord.Member, s
         pass
     await action_coroutine(victim, reason[:510])
 
+    if res is not None:
+        th = await after_action_recorded(bot, res, action_type, victim, moderator, reason, attachement_url)
+    else:
+        # Thresholds need the counters to include this action, so they are enforced once it's recorded
+        async def when_recorded():
+            try:
+                await after_action_recorded(bot, await recorded, action_type, victim, moderator, reason, attachement_url)
+            except Exception as e:
+                bot.logger.warning(f"Couldn't enforce thresholds and log the {action_type} on {victim.id}: {e!r}")
+
+        asyncio.ensure_future(when_recorded())
+        th = None
+
+    return {"user_informed": None,
+            "url": url,
+            "thresholds_enforced": th,
+            "case_number": case_number,
+            "recorded": recorded}
+
+
+async def after_action_recorded(bot, res: dict, action_type: str, victim: typing.Union[discord.Member, FakeMember], moderator: typing.Union[discord.Member, LikeUser],
+                                reason: str = None, attachement_url: str = None) -> bool:
+    url = "https://getbeaned.me" + res['result_url']
+    case_number = res['case_number']
+
     th = await thresholds_enforcer(bot, victim, action_type)
 
     if await bot.settings.get(victim.guild, 'logs_enable'):
@@ -232,7 +274,4 @@ async def full_process(bot, action_coroutine: typing.Callable[[discord.Member, s
 
                     asyncio.ensure_future(send(textual_log))
 
-    return {"user_informed": None,
-            "url": url,
-            "thresholds_enforced": th,
-            "case_number": case_number}
+    return th
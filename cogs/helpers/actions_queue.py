@@ -0,0 +1,205 @@
+import asyncio
+import concurrent.futures
+import json
+import sqlite3
+import time
+import typing
+import uuid
+
+import aiohttp
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+# Actions are written there before being sent to the WebInterface, so that they are not lost if the API is down or
+# the bot restarts. Rows are deleted once the API recorded them.
+ACTIONS_SPOOL_PATH = "actions_spool.sqlite3"
+ACTIONS_QUEUE_BATCH_SIZE = 20
+ACTIONS_QUEUE_BACKOFF_BASE = 2
+ACTIONS_QUEUE_BACKOFF_MAX = 600
+# Actions are retried forever, but failing that many times in a row is logged as an error
+ACTIONS_QUEUE_ERROR_ATTEMPTS = 12
+# Client errors that may go away by sending the action again. Actions refused with any other 4xx are dropped
+ACTIONS_QUEUE_RETRYABLE_STATUSES = {408, 409, 425, 429}
+# The worker waits that long after an unexpected error, like the spool being unavailable
+ACTIONS_QUEUE_ERROR_DELAY = 10
+
+
+class ActionsQueue:
+    """
+    Durable write-behind queue of actions to add to the WebInterface.
+
+    enqueue() records the action in a local SQLite spool and returns a future, resolved with the API response once a
+    background worker managed to send it. Failed sends are retried forever with a capped exponential backoff, using the
+    same idempotency key, so that a retry after a timeout doesn't record the action twice. Only actions the API refuses
+    with a client error are dropped.
+
+    Every query after the table creation runs in a dedicated thread, one at a time, so that commits never block the
+    event loop.
+    """
+
+    def __init__(self, bot: 'GetBeaned', path: str = ACTIONS_SPOOL_PATH):
+        self.bot = bot
+        self.db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS actions ("
+                        "idempotency_key TEXT PRIMARY KEY, "
+                        "data TEXT NOT NULL, "
+                        "attempts INTEGER NOT NULL DEFAULT 0, "
+                        "next_attempt_at REAL NOT NULL)")
+        self.db.commit()
+
+        # Only for actions enqueued since the bot started, the ones left in the spool by a previous run have none
+        self.waiters: typing.Dict[str, asyncio.Future] = {}
+        self.objects: typing.Dict[str, tuple] = {}
+
+        self.wakeup = asyncio.Event()
+        self.worker: typing.Optional[asyncio.Future] = None
+
+    def start(self):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+        await self.run_db(self.db.close)
+        self.db_executor.shutdown()
+
+    async def run_db(self, function: typing.Callable, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.db_executor, function, *args)
+
+    def db_write(self, query: str, parameters: tuple):
+        self.db.execute(query, parameters)
+        self.db.commit()
+
+    def db_due_actions(self, now: float) -> typing.Tuple[typing.List[tuple], typing.Optional[float]]:
+        rows = self.db.execute("SELECT idempotency_key, data, attempts FROM actions WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                               (now, ACTIONS_QUEUE_BATCH_SIZE)).fetchall()
+        next_attempt_at = self.db.execute("SELECT MIN(next_attempt_at) FROM actions").fetchone()[0]
+        return rows, next_attempt_at
+
+    def enqueue(self, guild: discord.Guild, user, action_type: str, reason: str, responsible_moderator, attachment: str = '',
+                automod_logs: typing.Optional[str] = None) -> asyncio.Future:
+        key = uuid.uuid4().hex
+        data = {'guild': guild.id,
+                'user': user.id,
+                'action_type': action_type,
+                'reason': reason,
+                'responsible_moderator': responsible_moderator.id,
+                'attachment': attachment,
+                'automod_logs': automod_logs}
+
+        future = asyncio.get_event_loop().create_future()
+        self.waiters[key] = future
+        self.objects[key] = (guild, user, responsible_moderator)
+
+        asyncio.ensure_future(self.spool(key, data))
+
+        return future
+
+    async def spool(self, key: str, data: dict):
+        try:
+            await self.run_db(self.db_write, "INSERT INTO actions (idempotency_key, data, next_attempt_at) VALUES (?, ?, ?)",
+                              (key, json.dumps(data), time.time()))
+        except Exception as e:
+            self.bot.logger.error(f"Couldn't spool action {key} ({data}): {e!r}")
+            self.settle(key, exception=e)
+            return
+
+        self.start()
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.bot.logger.exception("Error in the actions queue worker, retrying in a few seconds")
+                await asyncio.sleep(ACTIONS_QUEUE_ERROR_DELAY)
+
+    async def run_once(self):
+        self.wakeup.clear()
+        now = time.time()
+        rows, next_attempt_at = await self.run_db(self.db_due_actions, now)
+
+        if rows:
+            await asyncio.gather(*[self.send(key, json.loads(data), attempts) for key, data, attempts in rows])
+            return
+
+        timeout = max(next_attempt_at - now, 0) if next_attempt_at is not None else None
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def resolve(self, data: dict) -> tuple:
+        """
+        Find the guild and users of an action left in the spool by a previous run. They are only used to refresh the
+        website copies when they can be found, the action itself only needs their ids.
+        """
+        guild = self.bot.get_guild(data['guild']) or discord.Object(id=data['guild'])
+        user = self.bot.get_user(data['user']) or discord.Object(id=data['user'])
+        moderator = self.bot.get_user(data['responsible_moderator']) or discord.Object(id=data['responsible_moderator'])
+        return guild, user, moderator
+
+    async def send(self, key: str, data: dict, attempts: int):
+        api = self.bot.api
+        guild, user, moderator = self.objects.get(key) or self.resolve(data)
+
+        upserts = []
+        if not isinstance(guild, discord.Object):
+            upserts.append(api.add_guild(guild))
+        for u in (user, moderator):
+            if not isinstance(u, discord.Object):
+                upserts.append(api.add_user(u))
+
+        try:
+            await asyncio.gather(*upserts)
+
+            res = await api.post_action(guild, user, data['action_type'], data['reason'], moderator, data['attachment'], data['automod_logs'],
+                                        idempotency_key=key, raise_for_status=True)
+            if 'case_number' not in res:
+                raise ValueError(f"Unexpected response from the API: {res}")
+        except aiohttp.ClientResponseError as e:
+            if 400 <= e.status < 500 and e.status not in ACTIONS_QUEUE_RETRYABLE_STATUSES:
+                self.bot.logger.error(f"The API refused action {key} ({data}), dropping it: {e!r}")
+                await self.forget(key, exception=e)
+            else:
+                await self.retry_later(key, data, attempts + 1, e)
+            return
+        except Exception as e:
+            await self.retry_later(key, data, attempts + 1, e)
+            return
+
+        await self.forget(key, result=res)
+
+    async def retry_later(self, key: str, data: dict, attempts: int, exception: Exception):
+        delay = min(ACTIONS_QUEUE_BACKOFF_BASE ** min(attempts, 32), ACTIONS_QUEUE_BACKOFF_MAX)
+        if attempts == ACTIONS_QUEUE_ERROR_ATTEMPTS:
+            self.bot.logger.error(f"Adding action {key} ({data}) failed {attempts} times ({exception!r}), still retrying every {delay}s")
+        else:
+            self.bot.logger.warning(f"Adding action {key} failed ({exception!r}), retrying in {delay}s")
+        await self.run_db(self.db_write, "UPDATE actions SET attempts = ?, next_attempt_at = ? WHERE idempotency_key = ?",
+                          (attempts, time.time() + delay, key))
+
+    async def forget(self, key: str, result=None, exception: Exception = None):
+        await self.run_db(self.db_write, "DELETE FROM actions WHERE idempotency_key = ?", (key,))
+        self.settle(key, result=result, exception=exception)
+
+    def settle(self, key: str, result=None, exception: Exception = None):
+        self.objects.pop(key, None)
+        future = self.waiters.pop(key, None)
+        if future is not None and not future.done():
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
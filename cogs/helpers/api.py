@@ -22,11 +22,65 @@ API_TOKEN = credentials["web_token"]
 
 headers = {'Authorization': API_TOKEN}
 
+# Connection pool used to talk to the WebInterface. Every request goes to the same host, so the per-host limit is the
+# one that matters. They can be overridden in credentials.json if the API is hosted somewhere that can take more.
+API_CONNECTIONS_LIMIT = credentials.get("api_connections_limit", 100)
+API_CONNECTIONS_PER_HOST = credentials.get("api_connections_per_host", 30)
+API_KEEPALIVE_TIMEOUT = credentials.get("api_keepalive_timeout", 60)
+API_DNS_CACHE_TTL = 300
+API_REQUEST_TIMEOUT = 30
+
+# Users and guilds are upserted before most API calls. The last data successfully sent for each of them is remembered
+# so that unchanged ones aren't posted again, and entries expire so that the website copy is still refreshed sometimes.
+API_UPSERTS_REFRESH_AFTER = 3600
+API_UPSERTS_MAX_ENTRIES = 200000
+
+# Bulk actions (like bans imports) are sent by chunks, with a few requests in flight at once
+API_BULK_CHUNK_SIZE = 50
+API_BULK_CONCURRENCY = 10
+
 
 class Api:
     def __init__(self, bot: 'GetBeaned'):
         self.bot = bot
         self.logger = bot.logger
+        self.session: typing.Optional[aiohttp.ClientSession] = None
+        # ("user"|"guild", id) -> (fingerprint of the data sent, API response)
+        self.upserts_cache = bot.cache.get_cache("api_upserts", expire_after=API_UPSERTS_REFRESH_AFTER, strict=True,
+                                                 max_entries=API_UPSERTS_MAX_ENTRIES, eviction_policy="lru")
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the long-lived session shared by every API call, creating it on first use.
+
+        It has to be created from a coroutine, since aiohttp binds it to the running event loop.
+        """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=API_CONNECTIONS_LIMIT,
+                                             limit_per_host=API_CONNECTIONS_PER_HOST,
+                                             keepalive_timeout=API_KEEPALIVE_TIMEOUT,
+                                             ttl_dns_cache=API_DNS_CACHE_TTL)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=API_REQUEST_TIMEOUT))
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def get_upsert(self, key: typing.Tuple[str, int], fingerprint: int):
+        """
+        Return the API response of the last upsert for this key if the data sent was the same, else None.
+        """
+        cached = self.upserts_cache.get(key, None)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        return None
+
+    def store_upsert(self, key: typing.Tuple[str, int], fingerprint: int, response: aiohttp.ClientResponse, res):
+        if 200 <= response.status < 300:
+            self.upserts_cache[key] = (fingerprint, res)
+        else:
+            del self.upserts_cache[key]
 
     async def add_action_from_ctx(self, ctx: CustomContext, on: Union[discord.User, discord.Member, LikeUser, FakeMember], action_type: str, reason: str):
         if ctx.message.attachments:
@@ -39,7 +93,7 @@ class Api:
 
         # await ctx.send(res)
 
-    async def add_user(self, user: Union[discord.User, discord.Member, LikeUser, FakeMember]):
+    async def add_user(self, user: Union[discord.User, discord.Member, LikeUser, FakeMember], force: bool = False):
 
         if hasattr(user, 'do_not_update'):
             do_not_update = user.do_not_update
@@ -56,24 +110,27 @@ class Api:
                 'discord_avatar_url': str(user.avatar_url_as(static_format='png', size=1024)),
                 'discord_default_avatar_url': str(user.default_avatar_url),
                 }
-        # self.logger.debug(f"(add_user) -> {data}")
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + "/users/", data=data, headers=new_headers) as r:
-                try:
-                    res = await r.json()
-                except aiohttp.client_exceptions.ContentTypeError:
-                    print(await r.text())
-                    raise
-                # self.logger.debug(f"(add_user) <- {res}")
-                return res
 
-    async def add_guild(self, guild):
-        if guild.owner is None:
-            owner = await guild.fetch_member(guild.owner_id)
-        else:
-            owner = guild.owner
-        await self.add_user(owner)
+        key = ("user", user.id)
+        fingerprint = hash((new_headers['update'], ) + tuple(data.values()))
+        if not force:
+            res = self.get_upsert(key, fingerprint)
+            if res is not None:
+                return res
 
+        # self.logger.debug(f"(add_user) -> {data}")
+        cs = await self.get_session()
+        async with cs.post(API_URL + "/users/", data=data, headers=new_headers) as r:
+            try:
+                res = await r.json()
+            except aiohttp.client_exceptions.ContentTypeError:
+                print(await r.text())
+                raise
+            # self.logger.debug(f"(add_user) <- {res}")
+            self.store_upsert(key, fingerprint, r, res)
+            return res
+
+    async def add_guild(self, guild, force: bool = False):
         data = {'discord_id': guild.id,
                 'discord_name': guild.name,
                 'discord_icon_url': str(guild.icon_url) if guild.icon_url else f'https://cdn.discordapp.com/icons/{guild.id}.png',
@@ -81,14 +138,30 @@ class Api:
                 'discord_created_at': str(guild.created_at),
                 'discord_user_count': guild.member_count,
                 'owner': guild.owner_id}
-        # self.logger.debug(f"(add_guild) -> {data}")
 
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + "/guilds/", data=data, headers=headers) as r:
-                res = await r.json()
-                # self.logger.debug(f"(add_guild) <- {res}")
+        # Checked before the owner, so that an unchanged guild doesn't need the owner to be fetched either
+        key = ("guild", guild.id)
+        fingerprint = hash(tuple(data.values()))
+        if not force:
+            res = self.get_upsert(key, fingerprint)
+            if res is not None:
                 return res
 
+        if guild.owner is None:
+            owner = await guild.fetch_member(guild.owner_id)
+        else:
+            owner = guild.owner
+        await self.add_user(owner)
+
+        # self.logger.debug(f"(add_guild) -> {data}")
+
+        cs = await self.get_session()
+        async with cs.post(API_URL + "/guilds/", data=data, headers=headers) as r:
+            res = await r.json()
+            # self.logger.debug(f"(add_guild) <- {res}")
+            self.store_upsert(key, fingerprint, r, res)
+            return res
+
     async def add_action(self, guild: discord.guild, user: Union[discord.User, discord.Member, LikeUser, FakeMember], action_type: str, reason: str,
                          responsible_moderator: Union[discord.User, discord.Member, LikeUser, FakeMember], attachment: str = '',
                          automod_logs: typing.Optional[str] = None):
@@ -100,6 +173,18 @@ class Api:
             self.add_user(responsible_moderator),
         )
 
+        return await self.post_action(guild, user, action_type, reason, responsible_moderator, attachment, automod_logs)
+
+    async def post_action(self, guild: discord.guild, user: Union[discord.User, discord.Member, LikeUser, FakeMember], action_type: str, reason: str,
+                          responsible_moderator: Union[discord.User, discord.Member, LikeUser, FakeMember], attachment: str = '',
+                          automod_logs: typing.Optional[str] = None, idempotency_key: typing.Optional[str] = None,
+                          raise_for_status: bool = False):
+        """
+        Post the action itself, the guild and users must have been added already.
+
+        Retries of the same action must use the same idempotency key, so that it's only recorded once. With
+        raise_for_status, error responses raise an aiohttp.ClientResponseError, so callers can tell them apart.
+        """
         data = {'guild': guild.id,
                 'user': user.id,
                 'action_type': action_type,
@@ -109,21 +194,56 @@ class Api:
                 'automod_logs': automod_logs if automod_logs else ''}
 
         self.logger.debug(f"(add_action) -> {data}")
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + "/actions/", data=data, headers=headers) as r:
-                res = await r.json()
-                self.logger.debug(f"(add_action) <- {res}")
-                return res
+        if idempotency_key:
+            action_headers = headers.copy()
+            action_headers['Idempotency-Key'] = idempotency_key
+        else:
+            action_headers = headers
+
+        cs = await self.get_session()
+        async with cs.post(API_URL + "/actions/", data=data, headers=action_headers) as r:
+            if raise_for_status:
+                r.raise_for_status()
+            res = await r.json()
+            self.logger.debug(f"(add_action) <- {res}")
+            return res
+
+    async def add_actions_bulk(self, guild: discord.guild, actions: typing.List[typing.Tuple[Union[discord.User, LikeUser, FakeMember], str, str]],
+                               responsible_moderator: Union[discord.User, discord.Member, LikeUser, FakeMember],
+                               chunk_size: int = API_BULK_CHUNK_SIZE, concurrency: int = API_BULK_CONCURRENCY):
+        """
+        Add many (user, action_type, reason) actions by the same moderator, yielding (chunk users, chunk results) as chunks
+        are done, so that callers can report progress and checkpoint.
+
+        The guild and the moderator are only added once, and up to `concurrency` actions are sent at the same time.
+        A failed action is returned as its exception in the results, and doesn't stop the others.
+        """
+        await asyncio.gather(
+            self.add_guild(guild),
+            self.add_user(responsible_moderator),
+        )
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def add(user, action_type, reason):
+            async with semaphore:
+                await self.add_user(user)
+                return await self.post_action(guild, user, action_type, reason, responsible_moderator)
+
+        for start in range(0, len(actions), chunk_size):
+            chunk = actions[start:start + chunk_size]
+            results = await asyncio.gather(*[add(user, action_type, reason) for user, action_type, reason in chunk], return_exceptions=True)
+            yield [user for user, _, _ in chunk], results
 
     async def get_settings(self, guild: discord.Guild):
         await self.add_guild(guild)
         guild_id = guild.id
         # self.logger.debug(f"(get_settings) -> {guild_id}")
-        async with aiohttp.ClientSession() as cs:
-            async with cs.get(API_URL + f"/settings/{guild_id}/", headers=headers) as r:
-                res = await r.json()
-                # self.logger.debug(f"(get_settings) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.get(API_URL + f"/settings/{guild_id}/", headers=headers) as r:
+            res = await r.json()
+            # self.logger.debug(f"(get_settings) <- {res}")
+            return res
 
     async def set_settings(self, guild: discord.Guild, setting: str, value: str):
         await self.add_guild(guild)
@@ -131,11 +251,11 @@ class Api:
         data = {"setting": setting,
                 "value": value}
         self.logger.debug(f"(set_settings) -> {guild_id}, data={data}")
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + f"/settings/{guild_id}/", data=data, headers=headers) as r:
-                res = await r.json()
-                self.logger.debug(f"(set_settings) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.post(API_URL + f"/settings/{guild_id}/", data=data, headers=headers) as r:
+            res = await r.json()
+            self.logger.debug(f"(set_settings) <- {res}")
+            return res
 
     async def get_counters(self, guild: discord.Guild, user: discord.User):
         await self.add_guild(guild)
@@ -145,11 +265,11 @@ class Api:
         user_id = user.id
 
         # self.logger.debug(f"(get_counters) -> g={guild_id}, u={user_id}")
-        async with aiohttp.ClientSession() as cs:
-            async with cs.get(API_URL + f"/users/{guild_id}/{user_id}/counters/", headers=headers) as r:
-                res = await r.json()
-                # self.logger.debug(f"(get_counters) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.get(API_URL + f"/users/{guild_id}/{user_id}/counters/", headers=headers) as r:
+            res = await r.json()
+            # self.logger.debug(f"(get_counters) <- {res}")
+            return res
 
     async def add_to_staff(self, guild: discord.Guild, user: discord.User, staff_type: str):
         await self.add_user(user)
@@ -164,26 +284,26 @@ class Api:
 
         # self.logger.debug(f"(add_to_staff) -> g={guild_id}, d={data}")
 
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + f"/settings/{guild_id}/add_staff/", headers=headers, data=data) as r:
-                try:
-                    res = await r.json()
-                except aiohttp.client_exceptions.ContentTypeError:
-                    print(await r.text())
-                    raise
-                # self.logger.debug(f"(add_to_staff) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.post(API_URL + f"/settings/{guild_id}/add_staff/", headers=headers, data=data) as r:
+            try:
+                res = await r.json()
+            except aiohttp.client_exceptions.ContentTypeError:
+                print(await r.text())
+                raise
+            # self.logger.debug(f"(add_to_staff) <- {res}")
+            return res
 
     async def get_tasks(self):
-        async with aiohttp.ClientSession() as cs:
-            async with cs.get(API_URL + f"/tasks/", headers=headers) as r:
-                try:
-                    res = await r.json()
-                except aiohttp.client_exceptions.ContentTypeError:
-                    print(await r.text())
-                    raise
-                # self.logger.debug(f"(get_tasks) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.get(API_URL + f"/tasks/", headers=headers) as r:
+            try:
+                res = await r.json()
+            except aiohttp.client_exceptions.ContentTypeError:
+                print(await r.text())
+                raise
+            # self.logger.debug(f"(get_tasks) <- {res}")
+            return res
 
     async def create_task(self, task_type: str, arguments: str = None, execute_at: Union[str, datetime] = None):
         if arguments is not None and not isinstance(arguments, str):
@@ -192,26 +312,26 @@ class Api:
         if execute_at is not None and not isinstance(arguments, str):
             execute_at = str(execute_at)
 
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + f"/tasks/", headers=headers, data={"execute_at": execute_at, "task_type": task_type, "arguments": arguments}) as r:
-                try:
-                    res = await r.json()
-                except aiohttp.client_exceptions.ContentTypeError:
-                    print(await r.text())
-                    raise
-                self.logger.debug(f"(create_task) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.post(API_URL + f"/tasks/", headers=headers, data={"execute_at": execute_at, "task_type": task_type, "arguments": arguments}) as r:
+            try:
+                res = await r.json()
+            except aiohttp.client_exceptions.ContentTypeError:
+                print(await r.text())
+                raise
+            self.logger.debug(f"(create_task) <- {res}")
+            return res
 
     async def complete_task(self, task_id: int):
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + f"/tasks/{task_id}/complete", headers=headers) as r:
-                try:
-                    res = await r.json()
-                except aiohttp.client_exceptions.ContentTypeError:
-                    print(await r.text())
-                    raise
-                self.logger.debug(f"(complete_task) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.post(API_URL + f"/tasks/{task_id}/complete", headers=headers) as r:
+            try:
+                res = await r.json()
+            except aiohttp.client_exceptions.ContentTypeError:
+                print(await r.text())
+                raise
+            self.logger.debug(f"(complete_task) <- {res}")
+            return res
 
     async def save_roles(self, guild: discord.guild, user: Union[discord.Member, discord.User], roles: List[Union[discord.Role, int]]):
         await self.add_user(user)
@@ -227,28 +347,28 @@ class Api:
 
         roles_list = ",".join(roles_list)
 
-        async with aiohttp.ClientSession() as cs:
-            async with cs.post(API_URL + f"/rolepersist/{guild.id}/{user.id}", headers=headers, data={"roles_ids": roles_list}) as r:
-                try:
-                    res = await r.json()
-                except aiohttp.client_exceptions.ContentTypeError:
-                    print(await r.text())
-                    raise
-                self.logger.debug(f"(save_roles) <- {res}")
-                return res
+        cs = await self.get_session()
+        async with cs.post(API_URL + f"/rolepersist/{guild.id}/{user.id}", headers=headers, data={"roles_ids": roles_list}) as r:
+            try:
+                res = await r.json()
+            except aiohttp.client_exceptions.ContentTypeError:
+                print(await r.text())
+                raise
+            self.logger.debug(f"(save_roles) <- {res}")
+            return res
 
     async def get_stored_roles(self, guild: discord.Guild, user: Union[discord.Member, discord.User]) -> List[discord.Role]:
         await self.add_user(user)
         await self.add_guild(guild)
 
-        async with aiohttp.ClientSession() as cs:
-            async with cs.get(API_URL + f"/rolepersist/{guild.id}/{user.id}", headers=headers) as r:
-                try:
-                    res = await r.json()
-                except aiohttp.client_exceptions.ContentTypeError:
-                    print(await r.text())
-                    raise
-                self.logger.debug(f"(get_stored_roles) <- {res}")
+        cs = await self.get_session()
+        async with cs.get(API_URL + f"/rolepersist/{guild.id}/{user.id}", headers=headers) as r:
+            try:
+                res = await r.json()
+            except aiohttp.client_exceptions.ContentTypeError:
+                print(await r.text())
+                raise
+            self.logger.debug(f"(get_stored_roles) <- {res}")
 
         roles = []
 
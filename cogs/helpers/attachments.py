@@ -0,0 +1,180 @@
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import io
+import time
+import typing
+
+import aiohttp
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+try:
+    # noinspection PyUnresolvedReferences
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Bigger attachments aren't downloaded to be hashed, and at most that many are downloaded at the same time
+ATTACHMENTS_MAX_HASHED_SIZE = 8 * 1024 * 1024
+ATTACHMENTS_DOWNLOADS_CONCURRENCY = 4
+# Attachments that can't be downloaded that fast (waiting for a download slot included) aren't hashed, so that the
+# message is still checked quickly
+ATTACHMENTS_DOWNLOAD_TIMEOUT = 5
+# Images are reduced to (DHASH_SIZE + 1) * DHASH_SIZE grey pixels to compute their perceptual hash
+DHASH_SIZE = 8
+# Solid colors or plain gradients give hashes with almost all bits set or unset, shared by many unrelated images
+DHASH_MIN_BITS_SET = 4
+# Attachments posted in a guild are remembered for that long, and at most that many per guild
+RECENT_ATTACHMENTS_DURATION = 600
+RECENT_ATTACHMENTS_CAPACITY = 2000
+# The same attachment recently sent by that many members of a guild is spam
+ATTACHMENTS_REPEATED_AUTHORS = 3
+
+
+def image_dhash(data: bytes) -> typing.Optional[str]:
+    """
+    Difference hash of an image: close images (resized, recompressed, ...) get the same hash. Runs in a separate process.
+
+    None if the image can't be read, or is too plain for its hash to tell it apart from other images.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("L", (DHASH_SIZE * 8, DHASH_SIZE * 8))
+            pixels = list(image.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS).getdata())
+    except Exception:
+        return None  # Not an image Pillow can read
+
+    bits = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            left = pixels[row * (DHASH_SIZE + 1) + col]
+            right = pixels[row * (DHASH_SIZE + 1) + col + 1]
+            bits = bits << 1 | (left > right)
+
+    bits_set = bin(bits).count("1")
+    if bits_set < DHASH_MIN_BITS_SET or bits_set > DHASH_SIZE * DHASH_SIZE - DHASH_MIN_BITS_SET:
+        return None
+
+    return f"dhash:{bits:0{DHASH_SIZE * DHASH_SIZE // 4}x}"
+
+
+def content_sha1(data: bytes) -> str:
+    return f"sha1:{hashlib.sha1(data).hexdigest()}"
+
+
+class RecentAttachments:
+    """
+    Attachments hashes posted recently in a guild, with who posted them, to find the same file sent by many accounts.
+    """
+
+    def __init__(self, duration: float = RECENT_ATTACHMENTS_DURATION, capacity: int = RECENT_ATTACHMENTS_CAPACITY):
+        self.duration = duration
+        self.capacity = capacity
+        # hash -> (last posted at, {author id: posted at}), least recently posted first
+        self.hashes: typing.MutableMapping[str, typing.Tuple[float, typing.Dict[int, float]]] = collections.OrderedDict()
+
+    def expire(self, now: float):
+        while self.hashes:
+            last_posted_at, _ = next(iter(self.hashes.values()))
+            if last_posted_at >= now - self.duration:
+                break
+            self.hashes.popitem(last=False)
+
+    def add(self, attachment_hash: str, author_id: int, now: float = None) -> int:
+        """
+        Record a post of the hash, and return how many different authors posted it recently.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+
+        _, authors = self.hashes.pop(attachment_hash, (now, {}))
+        authors = {author: posted_at for author, posted_at in authors.items() if posted_at >= now - self.duration}
+        authors[author_id] = now
+        self.hashes[attachment_hash] = (now, authors)
+
+        while len(self.hashes) > self.capacity:
+            self.hashes.popitem(last=False)
+
+        return len(authors)
+
+
+class AttachmentsHasher:
+    """
+    Hash the attachments of messages without blocking the event loop: exact hashes are computed in a thread, and
+    perceptual hashes of images, if Pillow is installed, in a pool of processes.
+    """
+
+    def __init__(self, bot: 'GetBeaned'):
+        self.bot = bot
+        self.recent_attachments = bot.cache.get_cache("recent_attachments", expire_after=RECENT_ATTACHMENTS_DURATION, default=RecentAttachments)
+        self.process_pool: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.downloads_semaphore = asyncio.Semaphore(ATTACHMENTS_DOWNLOADS_CONCURRENCY)
+
+        if Image is None:
+            bot.logger.warning("Pillow is not installed, only exact images repeats will be detected. Consider installing Pillow.")
+
+    def get_process_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self.process_pool is None:
+            self.process_pool = concurrent.futures.ProcessPoolExecutor()
+        return self.process_pool
+
+    async def download(self, attachment: discord.Attachment) -> bytes:
+        async with self.downloads_semaphore:
+            return await attachment.read()
+
+    async def hash_attachment(self, attachment: discord.Attachment) -> typing.List[str]:
+        if attachment.size > ATTACHMENTS_MAX_HASHED_SIZE:
+            return []
+
+        try:
+            data = await asyncio.wait_for(self.download(attachment), ATTACHMENTS_DOWNLOAD_TIMEOUT)
+        except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError):
+            return []
+
+        loop = asyncio.get_event_loop()
+        hashes = [await loop.run_in_executor(None, content_sha1, data)]
+
+        if Image is not None and attachment.width is not None:
+            dhash = await loop.run_in_executor(self.get_process_pool(), image_dhash, data)
+            if dhash is not None:
+                hashes.append(dhash)
+
+        return hashes
+
+    async def hash_message(self, message: discord.Message) -> typing.Tuple[str, ...]:
+        """
+        Hashes of the message attachments, without duplicates. Attachments that couldn't be downloaded are skipped.
+        """
+        results = await asyncio.gather(*(self.hash_attachment(attachment) for attachment in message.attachments), return_exceptions=True)
+
+        hashes = []
+        for result in results:
+            if isinstance(result, Exception):
+                self.bot.logger.warning(f"Couldn't hash an attachment of message {message.id}: {result!r}")
+            else:
+                hashes.extend(result)
+
+        return tuple(dict.fromkeys(hashes))
+
+    def record_in_guild(self, guild: discord.Guild, author_id: int, hashes: typing.Iterable[str]) -> int:
+        """
+        Record the hashes posted in a guild, and return the most different authors that recently posted one of them.
+
+        Only exact hashes are compared across authors: unrelated images can share a perceptual hash.
+        """
+        hashes = [attachment_hash for attachment_hash in hashes if attachment_hash.startswith("sha1:")]
+        if not hashes:
+            return 0
+
+        recent = self.recent_attachments[guild.id]
+        self.recent_attachments.reset_expiry(guild.id)
+        return max(recent.add(attachment_hash, author_id) for attachment_hash in hashes)
+
+    def close(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+            self.process_pool = None
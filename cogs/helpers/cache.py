@@ -1,20 +1,202 @@
+import asyncio
 import collections
+import heapq
+import itertools
+import sys
 import time
 import typing
 from typing import Dict, Callable
 
 
+def approximate_size(value: typing.Any) -> int:
+    """
+    Size of a value in bytes, including the items it contains if it's a container (but not what *they* contain).
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset, collections.deque)):
+        size += sum(sys.getsizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+class EvictionPolicy:
+    """
+    Decides which key goes away when a size-bounded cache is full.
+    """
+    def __init__(self, cache: 'CacheStorageDict'):
+        self.cache = cache
+
+    def on_insert(self, key: typing.Hashable):
+        pass
+
+    def on_access(self, key: typing.Hashable):
+        pass
+
+    def on_delete(self, key: typing.Hashable):
+        pass
+
+    def victim(self, keep: typing.Hashable = None) -> typing.Hashable:
+        """
+        Key to evict, never `keep` (the key that was just set). The cache has at least one other key.
+        """
+        raise NotImplementedError()
+
+
+class LRUPolicy(EvictionPolicy):
+    """
+    Evict the least recently used key.
+    """
+    def __init__(self, cache: 'CacheStorageDict'):
+        super().__init__(cache)
+        self.order = collections.OrderedDict()
+
+    def on_insert(self, key: typing.Hashable):
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def on_access(self, key: typing.Hashable):
+        if key in self.order:
+            self.order.move_to_end(key)
+
+    def on_delete(self, key: typing.Hashable):
+        self.order.pop(key, None)
+
+    def victim(self, keep: typing.Hashable = None) -> typing.Hashable:
+        return next(key for key in self.order if key != keep)
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    Evict the least frequently used key (the least recently used one among them on ties).
+
+    Keys are grouped in buckets by use count, so every operation is O(1).
+    """
+    def __init__(self, cache: 'CacheStorageDict'):
+        super().__init__(cache)
+        self.frequencies: Dict[typing.Hashable, int] = {}
+        self.buckets: Dict[int, collections.OrderedDict] = collections.defaultdict(collections.OrderedDict)
+        self.min_frequency = 0
+
+    def remove_from_bucket(self, key: typing.Hashable, frequency: int):
+        bucket = self.buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[frequency]
+
+    def on_insert(self, key: typing.Hashable):
+        if key in self.frequencies:
+            self.on_access(key)
+        else:
+            self.frequencies[key] = 1
+            self.buckets[1][key] = None
+            self.min_frequency = 1
+
+    def on_access(self, key: typing.Hashable):
+        frequency = self.frequencies.get(key)
+        if frequency is None:
+            return
+
+        self.remove_from_bucket(key, frequency)
+        if self.min_frequency == frequency and frequency not in self.buckets:
+            self.min_frequency = frequency + 1
+
+        self.frequencies[key] = frequency + 1
+        self.buckets[frequency + 1][key] = None
+
+    def on_delete(self, key: typing.Hashable):
+        frequency = self.frequencies.pop(key, None)
+        if frequency is not None:
+            self.remove_from_bucket(key, frequency)
+
+    def victim(self, keep: typing.Hashable = None) -> typing.Hashable:
+        if self.min_frequency not in self.buckets:
+            # The least used keys were deleted, this only happens after a delete so the scan is fine
+            self.min_frequency = min(self.buckets)
+
+        for key in self.buckets[self.min_frequency]:
+            if key != keep:
+                return key
+
+        # The key that was just set is the only least used one, evict one of the next least used
+        return next(iter(self.buckets[min(f for f in self.buckets if f != self.min_frequency)]))
+
+
+class TTLPolicy(EvictionPolicy):
+    """
+    Evict the key that is the closest to expiring.
+    """
+    def victim(self, keep: typing.Hashable = None) -> typing.Hashable:
+        heap = self.cache.expiry_heap
+        times = self.cache.times
+        kept_entry = None
+
+        while True:
+            expire, _, key = heap[0]
+            if key in times and times[key] == expire:
+                if key != keep:
+                    break
+                kept_entry = heapq.heappop(heap)  # Put back once the victim is found
+            else:
+                heapq.heappop(heap)  # Outdated entry
+
+        if kept_entry is not None:
+            heapq.heappush(heap, kept_entry)
+        return key
+
+
+EVICTION_POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "ttl": TTLPolicy,
+}
+
+
 class CacheStorageDict(collections.MutableMapping):
-    def __init__(self, expire_after: float = 60, strict: bool = False, default: Callable = None, *args, **kwargs):
+    def __init__(self, expire_after: float = 60, strict: bool = False, default: Callable = None,
+                 stale_for: float = 0, refresh: Callable[[typing.Hashable], typing.Awaitable] = None,
+                 max_entries: int = None, max_bytes: int = None,
+                 eviction_policy: typing.Union[str, typing.Type[EvictionPolicy]] = "lru", *args, **kwargs):
+        """
+        With `strict`, expired keys are not returned anymore. If a `refresh` coroutine function is also given, expired
+        keys are still served for `stale_for` seconds after they expire, while `refresh(key)` runs in the background
+        and its result replaces the stale value.
+
+        `max_entries` and `max_bytes` bound the cache size. When one of them is exceeded, keys are evicted following
+        `eviction_policy` ("lru", "lfu", "ttl" or an EvictionPolicy subclass). Sizes are approximate: they are measured
+        when a value is set, so a container that grows after being stored isn't accounted for.
+        """
         self.store = dict()
         self.times = dict()
         self.expire_after = expire_after
         self.strict = strict
         self.default_func = default
+        self.stale_for = stale_for if refresh is not None else 0
+        self.refresh_func = refresh
+        self.refreshing = set()
+        # Min-heap of (expire, sequence, key), so that expired keys can be found without looking at every key.
+        # Entries are never removed when a key is deleted or its expiry is reset: they are skipped when their expire
+        # time doesn't match self.times anymore, and the heap is rebuilt when there are too many of them.
+        self.expiry_heap = []
+        self.expiry_sequence = itertools.count()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizes: Dict[typing.Hashable, int] = {}
+        self.stored_bytes = 0
+        self.evictions = 0
+        if max_entries is None and max_bytes is None:
+            self.eviction = None
+        else:
+            if isinstance(eviction_policy, str):
+                eviction_policy = EVICTION_POLICIES[eviction_policy]
+            self.eviction: typing.Optional[EvictionPolicy] = eviction_policy(self)
         self.update(dict(*args, **kwargs))  # use the free update to set keys
         self._expired_keys = 0
         self.hits = 0
         self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
 
     def get(self, key: typing.Hashable, default: typing.Any = None):
         try:
@@ -26,22 +208,90 @@ class CacheStorageDict(collections.MutableMapping):
         except KeyError:
             return default
 
+    def set_expiry(self, key: typing.Hashable, expire: float):
+        self.times[key] = expire
+        heapq.heappush(self.expiry_heap, (expire, next(self.expiry_sequence), key))
+
+        if len(self.expiry_heap) > 2 * len(self.times) + 64:
+            self.expiry_heap = [(expire, next(self.expiry_sequence), key) for key, expire in self.times.items()]
+            heapq.heapify(self.expiry_heap)
+
     def reset_expiry(self, key: typing.Hashable, seconds: float = None):
         if seconds is None:
-            self.times[key] = time.time() + self.expire_after
+            self.set_expiry(key, time.time() + self.expire_after)
         else:
-            self.times[key] = time.time() + seconds
+            self.set_expiry(key, time.time() + seconds)
+
+    def schedule_refresh(self, key: typing.Hashable):
+        if key in self.refreshing:
+            return  # Already on it
+
+        self.refreshing.add(key)
+
+        async def do_refresh():
+            try:
+                value = await self.refresh_func(key)
+            except Exception:
+                # Keep serving the stale value, the next read will try again
+                self.refresh_failures += 1
+            else:
+                self.refreshes += 1
+                self[key] = value
+            finally:
+                self.refreshing.discard(key)
+
+        asyncio.ensure_future(do_refresh())
 
-    def cleanup(self) -> int:
+    def cleanup(self, max_keys: int = None) -> int:
+        """
+        Delete expired keys, oldest first, and return how many were deleted.
+
+        If `max_keys` is given, stop after that many, so that big caches can be cleaned in slices.
+        """
         i = 0
-        for key, expire in list(self.times.items()):
-            if time.time() > expire:
+        limit = time.time() - self.stale_for
+        heap = self.expiry_heap
+
+        while heap and heap[0][0] < limit:
+            expire, _, key = heapq.heappop(heap)
+            if key in self.times and self.times[key] == expire:
                 i += 1
                 del self[key]
+                if max_keys is not None and i >= max_keys:
+                    break
 
         self._expired_keys += i
         return i
 
+    def get_expired_keys(self) -> typing.Set[typing.Hashable]:
+        """
+        Find the stored keys that are expired.
+
+        This walks the heap from the top and stops going down a branch as soon as it finds a key that is not expired
+        yet, so it only looks at the expired entries and their direct children.
+        """
+        now = time.time()
+        heap = self.expiry_heap
+        expired = set()
+        to_visit = [0]
+
+        while to_visit:
+            i = to_visit.pop()
+            if i >= len(heap):
+                continue
+
+            expire, _, key = heap[i]
+            if expire >= now:
+                continue
+
+            if key in self.times and self.times[key] == expire:
+                expired.add(key)
+
+            to_visit.append(2 * i + 1)
+            to_visit.append(2 * i + 2)
+
+        return expired
+
     def get_status(self) -> typing.Dict[str, int]:
         status_dict = {
             "expired_keys": set(),
@@ -50,11 +300,14 @@ class CacheStorageDict(collections.MutableMapping):
             "expired_keys_count": 0,
             "hits": self.hits,
             "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "evictions": self.evictions,
+            "stored_bytes": self.stored_bytes,
         }
 
-        for key, expire in self.times.items():
-            if time.time() > expire:
-                status_dict["expired_keys"].add(key)
+        status_dict["expired_keys"] = self.get_expired_keys()
 
         status_dict["stored_keys_count"] = len(self.store)
         status_dict["stored_expired_keys_count"] = len(status_dict["expired_keys"])
@@ -72,6 +325,14 @@ class CacheStorageDict(collections.MutableMapping):
                 return None
 
         if self.strict and time.time() > self.times.get(key, 0):
+            if time.time() <= self.times.get(key, 0) + self.stale_for:
+                # Serve the stale value while it's being refreshed
+                self.stale_hits += 1
+                self.schedule_refresh(key)
+                if self.eviction is not None:
+                    self.eviction.on_access(key)
+                return self.store[key]
+
             self.misses += 1
             self._expired_keys += 1
             del self[key]
@@ -83,14 +344,34 @@ class CacheStorageDict(collections.MutableMapping):
 
             # raise KeyError("The key expired and strict mode is set")
         self.hits += 1
+        if self.eviction is not None:
+            self.eviction.on_access(key)
         return self.store[key]
 
     def __contains__(self, item):
-        return item in self.times and (not self.strict or time.time() <= self.times[item])
+        return item in self.times and (not self.strict or time.time() <= self.times[item] + self.stale_for)
+
+    def enforce_limits(self, keep: typing.Hashable):
+        while (self.max_entries is not None and len(self.store) > self.max_entries) or \
+                (self.max_bytes is not None and self.stored_bytes > self.max_bytes):
+            if len(self.store) <= 1:
+                break  # A single value bigger than max_bytes, keep it anyway
+            victim = self.eviction.victim(keep)
+            del self[victim]
+            self.evictions += 1
 
     def __setitem__(self, key: typing.Hashable, value):
         self.store[key] = value
-        self.times[key] = time.time() + self.expire_after
+        self.set_expiry(key, time.time() + self.expire_after)
+
+        if self.eviction is not None:
+            if self.max_bytes is not None:
+                size = approximate_size(value)
+                self.stored_bytes += size - self.sizes.get(key, 0)
+                self.sizes[key] = size
+
+            self.eviction.on_insert(key)
+            self.enforce_limits(keep=key)
 
     def __delitem__(self, key: typing.Hashable):
         try:
@@ -98,6 +379,10 @@ class CacheStorageDict(collections.MutableMapping):
         except KeyError:
             pass
 
+        if self.eviction is not None:
+            self.eviction.on_delete(key)
+            self.stored_bytes -= self.sizes.pop(key, 0)
+
         try:
             del self.times[key]
         except KeyError:
@@ -110,7 +395,8 @@ class CacheStorageDict(collections.MutableMapping):
         return len(self.store)
 
     def __str__(self):
-        return f"<Cache ttl={self.expire_after} keys_stored_count={len(self.store)} strict={self.strict}>"
+        return f"<Cache ttl={self.expire_after} keys_stored_count={len(self.store)} strict={self.strict} stale_for={self.stale_for} " \
+               f"max_entries={self.max_entries} max_bytes={self.max_bytes}>"
 
 
 class Cache:
@@ -1,12 +1,83 @@
 """
 These are checks to see if some commands can be executed by users.
 """
+import typing
+
 import discord
 from discord.ext import commands
 
 from cogs.helpers.context import CustomContext
 from cogs.helpers.level import get_level
 
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+
+def permissions_mask(**permissions) -> int:
+    mask = discord.permissions.Permissions.none()
+    mask.update(**permissions)
+    return mask.value
+
+
+# Permissions the bot needs, as bitmasks
+MODERATION_PERMISSIONS = permissions_mask(
+    kick_members=True,
+    ban_members=True,
+    read_messages=True,
+    send_messages=True,
+    manage_messages=True,
+    embed_links=True,
+    attach_files=True,
+    read_message_history=True,
+    external_emojis=True,
+    change_nickname=True,
+)
+COMMANDS_PERMISSIONS = MODERATION_PERMISSIONS | permissions_mask(add_reactions=True)
+MINIMAL_COMMANDS_PERMISSIONS = permissions_mask(
+    read_messages=True,
+    send_messages=True,
+    embed_links=True,
+    attach_files=True,
+    add_reactions=True
+)
+
+# The bot permissions in all the channels of a guild are forgotten that long after the first one was computed, or
+# sooner if the channel overwrites, the guild roles or the bot roles change.
+BOT_PERMISSIONS_CACHE_EXPIRE = 600
+
+
+def get_bot_permissions_cache(bot: 'GetBeaned'):
+    # guild id -> {channel id: permissions value}
+    return bot.cache.get_cache("bot_channels_permissions", expire_after=BOT_PERMISSIONS_CACHE_EXPIRE, strict=True, default=dict)
+
+
+def invalidate_bot_channel_permissions(bot: 'GetBeaned', channel: discord.abc.GuildChannel):
+    permissions = get_bot_permissions_cache(bot)
+    if channel.guild.id in permissions:
+        permissions[channel.guild.id].pop(channel.id, None)
+
+
+def invalidate_bot_guild_permissions(bot: 'GetBeaned', guild: discord.Guild):
+    del get_bot_permissions_cache(bot)[guild.id]
+
+
+def bot_permissions_in(bot: 'GetBeaned', channel: discord.abc.GuildChannel) -> int:
+    """
+    Bitmask of the bot permissions in a channel, from the cache if possible since resolving the overwrites is costly.
+    """
+    permissions = get_bot_permissions_cache(bot)[channel.guild.id]
+    value = permissions.get(channel.id)
+
+    if value is None:
+        value = channel.guild.me.permissions_in(channel).value
+        permissions[channel.id] = value
+
+    return value
+
+
+def bot_can(bot: 'GetBeaned', channel: discord.abc.GuildChannel, wanted_permissions: int) -> bool:
+    return bot_permissions_in(bot, channel) & wanted_permissions == wanted_permissions
+
 
 class PermissionsError(commands.CheckFailure):
     def __init__(self, required, current):
@@ -36,23 +107,7 @@ def have_required_level(required: int = 0):
 def bot_have_permissions():
     async def predicate(ctx: CustomContext) -> bool:
         await ctx.bot.wait_until_ready()
-        current_permissions = ctx.message.guild.me.permissions_in(ctx.channel)
-        wanted_permissions = discord.permissions.Permissions.none()
-        wanted_permissions.update(
-            kick_members=True,
-            ban_members=True,
-            read_messages=True,
-            send_messages=True,
-            manage_messages=True,
-            embed_links=True,
-            attach_files=True,
-            read_message_history=True,
-            external_emojis=True,
-            change_nickname=True,
-            add_reactions=True
-        )
-
-        cond = current_permissions >= wanted_permissions
+        cond = bot_can(ctx.bot, ctx.channel, COMMANDS_PERMISSIONS)
 
         ctx.logger.debug(f"Check for permissions required returned {cond}")
 
@@ -67,17 +122,7 @@ def bot_have_permissions():
 def bot_have_minimal_permissions():
     async def predicate(ctx: CustomContext) -> bool:
         await ctx.bot.wait_until_ready()
-        current_permissions = ctx.message.guild.me.permissions_in(ctx.channel)
-        wanted_permissions = discord.permissions.Permissions.none()
-        wanted_permissions.update(
-            read_messages=True,
-            send_messages=True,
-            embed_links=True,
-            attach_files=True,
-            add_reactions=True
-        )
-
-        cond = current_permissions >= wanted_permissions
+        cond = bot_can(ctx.bot, ctx.channel, MINIMAL_COMMANDS_PERMISSIONS)
 
         ctx.logger.debug(f"Check for permissions required returned {cond}")
 
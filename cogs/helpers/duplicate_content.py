@@ -0,0 +1,93 @@
+import collections
+import re
+import time
+import typing
+
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+# Messages are compared across authors for that long, split in that many buckets that expire one at a time
+DUPLICATE_CONTENT_DURATION = 300
+DUPLICATE_CONTENT_BUCKETS = 10
+# Bounds of each bucket: new contents aren't recorded once it's full, and authors aren't counted past the limit
+DUPLICATE_CONTENT_MAX_FINGERPRINTS = 2000
+DUPLICATE_CONTENT_MAX_AUTHORS = 50
+# Shorter messages ("hi", "lol", ...) are sent by many people without being spam
+DUPLICATE_CONTENT_MIN_LENGTH = 15
+# The same content recently sent by that many members of a guild is spam
+DUPLICATE_CONTENT_AUTHORS = 4
+
+# Mentions, custom emojis and anything that isn't a letter or a digit are ignored to compare contents
+MENTIONS_REGEX = re.compile(r"<(?:@[!&]?|#|a?:\w+:)\d+>")
+NOT_ALPHANUMERIC_REGEX = re.compile(r"[\W_]+")
+
+
+def content_fingerprint(content: str) -> typing.Optional[int]:
+    """
+    Fingerprint of the normalized message content, the same for messages that only differ by case, spacing,
+    punctuation or mentions. None for contents too short to be compared.
+    """
+    normalized = NOT_ALPHANUMERIC_REGEX.sub("", MENTIONS_REGEX.sub("", content)).casefold()
+    if len(normalized) < DUPLICATE_CONTENT_MIN_LENGTH:
+        return None
+    return hash(normalized)
+
+
+class DuplicateContentIndex:
+    """
+    Who sent which content recently in a guild, in time buckets. Adding a message and counting who sent the same content
+    only look at a fixed number of buckets, and each bucket is bounded, whatever the guild activity.
+    """
+
+    def __init__(self, duration: float = DUPLICATE_CONTENT_DURATION, buckets_count: int = DUPLICATE_CONTENT_BUCKETS):
+        self.bucket_duration = duration / buckets_count
+        self.buckets_count = buckets_count
+        # (bucket number, {fingerprint: authors ids}), oldest first
+        self.buckets: typing.Deque[typing.Tuple[int, typing.Dict[int, typing.Set[int]]]] = collections.deque()
+
+    def current_bucket(self, now: float) -> typing.Dict[int, typing.Set[int]]:
+        number = int(now // self.bucket_duration)
+
+        while self.buckets and self.buckets[0][0] <= number - self.buckets_count:
+            self.buckets.popleft()
+
+        if not self.buckets or self.buckets[-1][0] != number:
+            self.buckets.append((number, {}))
+
+        return self.buckets[-1][1]
+
+    def add(self, fingerprint: int, author_id: int, now: float = None) -> int:
+        """
+        Record that the author sent this content, and return how many different authors recently sent it.
+        """
+        bucket = self.current_bucket(time.time() if now is None else now)
+
+        authors = bucket.get(fingerprint)
+        if authors is None and len(bucket) < DUPLICATE_CONTENT_MAX_FINGERPRINTS:
+            authors = bucket[fingerprint] = set()
+        if authors is not None and len(authors) < DUPLICATE_CONTENT_MAX_AUTHORS:
+            authors.add(author_id)
+
+        return len(set().union(*(bucket.get(fingerprint, ()) for _, bucket in self.buckets)) | {author_id})
+
+
+def get_duplicate_content_indexes(bot: 'GetBeaned'):
+    # guild id -> DuplicateContentIndex
+    return bot.cache.get_cache("duplicate_content_indexes", expire_after=DUPLICATE_CONTENT_DURATION, default=DuplicateContentIndex)
+
+
+def record_content(bot: 'GetBeaned', message: discord.Message) -> int:
+    """
+    Record the message content in its guild index, and return how many different authors recently sent the same content.
+    0 if the content is too short to be compared.
+    """
+    fingerprint = content_fingerprint(message.content)
+    if fingerprint is None:
+        return 0
+
+    indexes = get_duplicate_content_indexes(bot)
+    index = indexes[message.guild.id]
+    indexes.reset_expiry(message.guild.id)
+    return index.add(fingerprint, message.author.id)
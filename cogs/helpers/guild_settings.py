@@ -1,20 +1,340 @@
+import asyncio
+import logging
 import re
 import typing
 
 import discord
 
+try:
+    # noinspection PyUnresolvedReferences
+    import regex
+except ImportError:
+    regex = None
+
+from cogs.helpers.level import invalidate_guild_levels
+
 if typing.TYPE_CHECKING:
     from cogs.helpers.GetBeaned import GetBeaned
 
+# For how long expired settings can still be used while they are re-downloaded in the background
+SETTINGS_STALE_FOR = 1800
+
+DEFAULT_BAD_WORDS = ['nigga', 'fuck', 'cunt', 'dick', 'cock', 'sex', 'nigger']
+
+# Regexes longer than this are refused. Regexes with a repeated group that itself contains a quantifier, like (a+)+,
+# (\w*\s?)* or (.*a){12}, or with a repeated alternation whose branches can match the same text, like (a|aa)+ or
+# (\w|a)+, can take forever to run on some strings: they are run with a timeout if the regex module is installed,
+# and refused otherwise. This is only a heuristic: groups nested in the repeated one, or consecutive quantifiers
+# like .*.*.*, aren't detected.
+MAX_BAD_REGEX_LENGTH = 500
+BAD_REGEX_TIMEOUT = 0.05
+NESTED_QUANTIFIERS_REGEX = re.compile(r"\((?:[^()\\]|\\.)*(?:[+*]|\{\d+(?:,\d*)?\})(?:[^()\\]|\\.)*\)(?:[+*]|\{\d+(?:,\d*)?\})")
+REPEATED_ALTERNATION_REGEX = re.compile(r"\(((?:[^()\\]|\\.)*\|(?:[^()\\]|\\.)*)\)(?:[+*]|\{\d+(?:,\d*)?\})")
+GROUP_PREFIX_REGEX = re.compile(r"\?(?::|P<\w+>|[aiLmsux-]+:)")
+REGEX_SPECIAL_CHARACTERS = frozenset(".^$*+?{}[]()|")
+
+# Flags like (?i) apply to the whole regex, they have to be turned into scoped flags like (?i:...) before the
+# regex can be put in a bigger one.
+GLOBAL_FLAGS_REGEX = re.compile(r"\(\?([aiLmsux]+)\)")
+
+# Numbered backreferences would point to the wrong group once the regex is put in a bigger one
+NUMBERED_BACKREFERENCE_REGEX = re.compile(r"\\[1-9]")
+
+
+def word_pattern(word: str) -> str:
+    return f"\\b{word}\\b(?i)(?m)"
+
+
+def scope_flags(pattern: str) -> str:
+    flags = "".join(GLOBAL_FLAGS_REGEX.findall(pattern))
+    if not flags:
+        return pattern
+
+    return f"(?{flags}:{GLOBAL_FLAGS_REGEX.sub('', pattern)})"
+
+
+def literal_branches(group: str) -> typing.Optional[typing.List[str]]:
+    """
+    The branches of an alternation, as the strings they match, or None if one of them isn't a plain string.
+    """
+    group = GROUP_PREFIX_REGEX.sub("", group, count=1) if group.startswith("?") else group
+
+    branches = [""]
+    escaped = False
+    for char in group:
+        if escaped:
+            if char.isalnum():
+                return None  # \w, \d, ...
+            branches[-1] += char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "|":
+            branches.append("")
+        elif char in REGEX_SPECIAL_CHARACTERS:
+            return None
+        else:
+            branches[-1] += char
+
+    return branches
+
+
+def uniquely_decodable(words: typing.List[str]) -> bool:
+    """
+    Whether a string made of these words can only be split one way (Sardinas-Patterson test).
+    """
+    codewords = set(words)
+    if len(codewords) != len(words) or "" in codewords:
+        return False
+
+    suffixes = {b[len(a):] for a in codewords for b in codewords if a != b and b.startswith(a)}
+    seen = set()
+    while suffixes:
+        if suffixes & codewords:
+            return False
+
+        key = frozenset(suffixes)
+        if key in seen:
+            return True
+        seen.add(key)
+
+        suffixes = {b[len(a):] for a in suffixes for b in codewords if b.startswith(a)} | \
+                   {b[len(a):] for a in codewords for b in suffixes if b.startswith(a)}
+        suffixes.discard("")
+
+    return True
+
+
+def may_backtrack(pattern: str) -> bool:
+    """
+    Whether the regex may backtrack catastrophically. Repeated alternations of distinct characters or words, like
+    f(u|v)+ck or (cat|dog)+, are fine as long as a string can only be split one way between the branches.
+    """
+    if NESTED_QUANTIFIERS_REGEX.search(pattern):
+        return True
+
+    for match in REPEATED_ALTERNATION_REGEX.finditer(pattern):
+        branches = literal_branches(match.group(1))
+        if branches is None or not uniquely_decodable([branch.casefold() for branch in branches]):
+            return True
+
+    return False
+
+
+class StaffIds:
+    """
+    The permissions_* lists of a guild settings, as frozensets of users and roles IDs.
+    """
+    __slots__ = ('settings', 'admins', 'moderators', 'trusted', 'banned')
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.admins = frozenset(settings['permissions_admins'])
+        self.moderators = frozenset(settings['permissions_moderators'])
+        self.trusted = frozenset(settings['permissions_trusted'])
+        self.banned = frozenset(settings['permissions_banned'])
+
+    def same_as(self, other: 'StaffIds') -> bool:
+        return (self.admins, self.moderators, self.trusted, self.banned) == (other.admins, other.moderators, other.trusted, other.banned)
+
+
+class BadWordsMatcher:
+    """
+    A list of bad words regexes, merged into a single regex so that a message is searched once for all of them.
+
+    Each regex is a named group of the merged one, so we still know which ones matched. As alternatives can't overlap,
+    when something is found, the regexes that were not are checked one by one to give the exact same results as
+    searching for each regex separately. Regexes that can't be merged, and those that may backtrack catastrophically,
+    are always searched separately. Refused regexes are kept with the reason in `refused`, to be shown to the guild.
+    """
+
+    def __init__(self, patterns: typing.Iterable[str], logger: typing.Optional[logging.Logger] = None):
+        self.source = None
+        self.patterns: typing.List[typing.Tuple[str, typing.Pattern]] = []
+        self.separate_patterns: typing.List[int] = []
+        # Indexes of the patterns compiled with the regex module, to be searched with a timeout
+        self.timed_patterns: typing.Set[int] = set()
+        self.refused: typing.List[typing.Tuple[str, str]] = []
+
+        mergeable = []
+
+        for pattern in patterns:
+            timed = False
+            if len(pattern) > MAX_BAD_REGEX_LENGTH:
+                self.refuse(pattern, f"longer than {MAX_BAD_REGEX_LENGTH} characters", logger)
+                continue
+            elif may_backtrack(pattern):
+                if regex is None:
+                    self.refuse(pattern, "may take forever to run on some messages", logger)
+                    continue
+                timed = True
+
+            scoped_pattern = scope_flags(pattern)
+            try:
+                compiled = regex.compile(scoped_pattern) if timed else re.compile(scoped_pattern)
+            except Exception as e:
+                self.refuse(pattern, f"invalid ({e})", logger)
+                continue
+
+            index = len(self.patterns)
+            self.patterns.append((pattern, compiled))
+
+            if timed:
+                self.timed_patterns.add(index)
+                self.separate_patterns.append(index)
+            elif NUMBERED_BACKREFERENCE_REGEX.search(pattern):
+                self.separate_patterns.append(index)
+            else:
+                mergeable.append(f"(?P<_bw{index}>{scoped_pattern})")
+
+        self.merged = None
+        if mergeable:
+            try:
+                self.merged = re.compile("|".join(mergeable))
+            except Exception as e:
+                # Probably the same group name used in two regexes
+                if logger:
+                    logger.debug(f"Couldn't merge bad words regexes -> {e}")
+                self.separate_patterns = list(range(len(self.patterns)))
+
+    def refuse(self, pattern: str, reason: str, logger: typing.Optional[logging.Logger]):
+        self.refused.append((pattern, reason))
+        if logger:
+            logger.info(f"Bad word regex {pattern} refused: {reason}")
+
+    def search_one(self, i: int, string: str) -> bool:
+        compiled = self.patterns[i][1]
+        if i not in self.timed_patterns:
+            return compiled.search(string) is not None
+
+        try:
+            return compiled.search(string, timeout=BAD_REGEX_TIMEOUT) is not None
+        except TimeoutError:
+            return False
+
+    def search(self, string: str) -> typing.List[typing.Tuple[str, str]]:
+        found = set()
+        to_check = self.separate_patterns
+
+        if self.merged is not None:
+            for match in self.merged.finditer(string):
+                found.add(int(match.lastgroup[3:]))
+
+            if found:
+                to_check = [i for i in range(len(self.patterns)) if i not in found]
+
+        for i in to_check:
+            if self.search_one(i, string):
+                found.add(i)
+
+        return [(string, self.patterns[i][0]) for i in sorted(found)]
+
+
+DEFAULT_BAD_WORDS_MATCHER = BadWordsMatcher([word_pattern(word) for word in DEFAULT_BAD_WORDS])
+
+
+class AutomodPolicy:
+    """
+    Everything the AutoMod needs to know about a guild settings, read once when the settings are downloaded, so that
+    checking a message is only attribute lookups instead of a Settings.get call for every value.
+
+    A policy is never modified: when the settings are downloaded again, a new policy replaces the old one.
+    """
+    __slots__ = ('settings', 'enabled', 'ignore_level',
+                 'multiplicator_offline', 'multiplicator_new_account', 'multiplicator_just_joined', 'multiplicator_have_nitro',
+                 'multiplicator_have_roles', 'multiplicator_bot_banned',
+                 'score_caps', 'score_everyone', 'score_too_many_mentions', 'score_contain_invites', 'score_repeated', 'score_duplicate_content',
+                 'score_duplicate_attachments', 'score_bad_words', 'score_multimessage_too_many_mentions', 'score_multimessage_too_many_users_mentions', 'score_zalgo',
+                 'minimal_membercount_trust_server', 'note_message_deletions',
+                 'delete_message_score', 'warn_score', 'kick_score', 'softban_score', 'ban_score',
+                 'autotrigger_enabled', 'autotriggers_scores')
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+
+        self.enabled = settings['automod_enable']
+        self.ignore_level = settings['automod_ignore_level']
+
+        self.multiplicator_offline = settings['automod_multiplictor_offline']
+        self.multiplicator_new_account = settings['automod_multiplictor_new_account']
+        self.multiplicator_just_joined = settings['automod_multiplictor_just_joined']
+        self.multiplicator_have_nitro = settings['automod_multiplictor_have_nitro']
+        self.multiplicator_have_roles = settings['automod_multiplictor_have_roles']
+        self.multiplicator_bot_banned = settings['automod_multiplictor_bot_banned']
+
+        self.score_caps = settings['automod_score_caps']
+        self.score_everyone = settings['automod_score_everyone']
+        self.score_too_many_mentions = settings['automod_score_too_many_mentions']
+        self.score_contain_invites = settings['automod_score_contain_invites']
+        self.score_repeated = settings['automod_score_repeated']
+        # Not sent by the API yet, disabled until they are
+        self.score_duplicate_content = settings.get('automod_score_duplicate_content', 0)
+        self.score_duplicate_attachments = settings.get('automod_score_duplicate_attachments', 0)
+        self.score_bad_words = settings['automod_score_bad_words']
+        self.score_multimessage_too_many_mentions = settings['automod_score_multimessage_too_many_mentions']
+        self.score_multimessage_too_many_users_mentions = settings['automod_score_multimessage_too_many_users_mentions']
+        self.score_zalgo = settings['automod_score_zalgo']
+
+        self.minimal_membercount_trust_server = settings['automod_minimal_membercount_trust_server']
+        self.note_message_deletions = settings['automod_note_message_deletions']
+
+        self.delete_message_score = settings['automod_delete_message_score']
+        self.warn_score = settings['automod_warn_score']
+        self.kick_score = settings['automod_kick_score']
+        self.softban_score = settings['automod_softban_score']
+        self.ban_score = settings['automod_ban_score']
+
+        self.autotrigger_enabled = settings['autotrigger_enable']
+        # autotrigger_{dbname}_score -> {dbname: score}
+        self.autotriggers_scores = {name[len('autotrigger_'):-len('_score')]: score for name, score in settings.items()
+                                    if name.startswith('autotrigger_') and name.endswith('_score')}
+
 
 class Settings:
     def __init__(self, bot: 'GetBeaned'):
         self.bot = bot
-        self.settings_cache = bot.cache.get_cache("settings", expire_after=900, strict=True)
+        self.settings_cache = bot.cache.get_cache("settings", expire_after=900, strict=True, stale_for=SETTINGS_STALE_FOR, refresh=self.fetch)
         self.vip_bad_regex_cache = bot.cache.get_cache("vip_bad_regex", expire_after=1200, strict=False)
+        self.automod_policies_cache = bot.cache.get_cache("automod_policies", expire_after=900 + SETTINGS_STALE_FOR, strict=False)
+        self.staff_ids_cache = bot.cache.get_cache("staff_ids", expire_after=900 + SETTINGS_STALE_FOR, strict=False)
+        self.pending_fetches: typing.Dict[int, asyncio.Future] = {}
+
+        if regex is None:
+            bot.logger.warning("regex is not installed, custom bad words regexes that may run for too long will be refused. Consider installing regex.")
 
     async def add_to_cache(self, guild: discord.Guild, settings: dict):
         self.settings_cache[guild] = settings
+        self.automod_policies_cache[guild] = AutomodPolicy(settings)
+
+        staff_ids = StaffIds(settings)
+        previous_staff_ids = self.staff_ids_cache.get(guild)
+        self.staff_ids_cache[guild] = staff_ids
+
+        # The staff can also be changed from the website
+        if previous_staff_ids is not None and not staff_ids.same_as(previous_staff_ids):
+            invalidate_guild_levels(self.bot, guild)
+
+    async def fetch(self, guild: discord.Guild) -> dict:
+        """
+        Get the guild settings from the API and cache them.
+
+        Only one request per guild is in flight at a time: every caller that misses the cache while a fetch is running
+        waits on that same fetch instead of starting its own.
+        """
+        pending = self.pending_fetches.get(guild.id)
+
+        if pending is None:
+            async def do_fetch():
+                gs = await self.bot.api.get_settings(guild)
+                await self.add_to_cache(guild, gs)
+                return gs
+
+            pending = asyncio.ensure_future(do_fetch())
+            self.pending_fetches[guild.id] = pending
+            pending.add_done_callback(lambda _: self.pending_fetches.pop(guild.id, None))
+
+        # Shielded, so that a cancelled waiter doesn't cancel the fetch for everyone else
+        return await asyncio.shield(pending)
 
     async def get(self, guild: discord.Guild, setting: str):
         await self.bot.wait_until_ready()
@@ -25,10 +345,41 @@ class Settings:
             return gs[setting]
         else:
             # Get from internet
-            gs = await self.bot.api.get_settings(guild)
-            await self.add_to_cache(guild, gs)
+            gs = await self.fetch(guild)
             return gs[setting]
 
+    async def get_all(self, guild: discord.Guild) -> dict:
+        await self.bot.wait_until_ready()
+
+        gs = self.settings_cache[guild]
+
+        if gs:  # Use cache
+            return gs
+        else:
+            # Get from internet
+            return await self.fetch(guild)
+
+    async def get_automod_policy(self, guild: discord.Guild) -> AutomodPolicy:
+        gs = await self.get_all(guild)
+        policy = self.automod_policies_cache.get(guild)
+
+        if policy is None or policy.settings is not gs:
+            # The policy was evicted, or the settings were put in the cache without going thru add_to_cache
+            policy = AutomodPolicy(gs)
+            self.automod_policies_cache[guild] = policy
+
+        return policy
+
+    async def get_staff_ids(self, guild: discord.Guild) -> StaffIds:
+        gs = await self.get_all(guild)
+        staff_ids = self.staff_ids_cache.get(guild)
+
+        if staff_ids is None or staff_ids.settings is not gs:
+            staff_ids = StaffIds(gs)
+            self.staff_ids_cache[guild] = staff_ids
+
+        return staff_ids
+
     async def set(self, guild: discord.Guild, setting: str, value):
         await self.bot.wait_until_ready()
         try:
@@ -36,39 +387,34 @@ class Settings:
         except KeyError:
             pass
 
+        del self.vip_bad_regex_cache[guild]
+
         await self.bot.api.set_settings(guild, setting, value)
 
-    async def get_bad_word_matches(self, guild: discord.Guild, string: str) -> typing.Iterable[typing.Tuple[str, str]]:
-        bad_regex_list = []
+        if setting.startswith("permissions_"):
+            invalidate_guild_levels(self.bot, guild)
 
+    async def get_bad_words_matcher(self, guild: discord.Guild) -> BadWordsMatcher:
         if not await self.get(guild, "vip"):
-            bad_words_list = ['nigga', 'fuck', 'cunt', 'dick', 'cock', 'sex', 'nigger']
-            for word in bad_words_list:
-                bad_regex_list.append(re.compile(f"\\b{word}\\b(?i)(?m)"))
-        else:
-            bad_regex_list = self.vip_bad_regex_cache[guild]
+            return DEFAULT_BAD_WORDS_MATCHER
 
-            if bad_regex_list is None:
-                bad_regex_list = []
-                words = await self.get(guild, "vip_custom_bad_words_list")
-                bad_words_list = str(words).splitlines(keepends=False)
-                regexes = [f"\\b{word}\\b(?i)(?m)" for word in bad_words_list]
+        words = await self.get(guild, "vip_custom_bad_words_list")
+        regexes_str = await self.get(guild, "vip_custom_bad_regex_list")
 
-                regexes_str = await self.get(guild, "vip_custom_bad_regex_list")
-                regexes = regexes + str(regexes_str).splitlines(keepends=False)
+        matcher = self.vip_bad_regex_cache[guild]
 
-                for regex in regexes:
-                    try:
-                        bad_regex_list.append(re.compile(regex))
-                    except Exception as e:
-                        self.bot.logger.debug(f"{regex} -> {e}")
+        # The lists can also be changed from the website, so check that the compiled ones are still the current ones
+        if matcher is None or matcher.source != (words, regexes_str):
+            bad_words_list = str(words).splitlines(keepends=False)
+            patterns = [word_pattern(word) for word in bad_words_list if word] + \
+                       [pattern for pattern in str(regexes_str).splitlines(keepends=False) if pattern]
 
-                self.vip_bad_regex_cache[guild] = bad_regex_list
+            matcher = BadWordsMatcher(patterns, logger=self.bot.logger)
+            matcher.source = (words, regexes_str)
+            self.vip_bad_regex_cache[guild] = matcher
 
-        matches = []
-        for regex in bad_regex_list:
-            match = regex.search(string)
-            if match:
-                matches.append((match.string, regex.pattern))
+        return matcher
 
-        return matches
+    async def get_bad_word_matches(self, guild: discord.Guild, string: str) -> typing.Iterable[typing.Tuple[str, str]]:
+        matcher = await self.get_bad_words_matcher(guild)
+        return matcher.search(string)
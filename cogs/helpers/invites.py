@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import time
+import typing
+
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+# Valid invites are kept for that long (and served for as long again while they are fetched in the background),
+# invalid ones for less since a code can be claimed later on.
+INVITES_CACHE_EXPIRE = 3600
+INVALID_INVITES_CACHE_EXPIRE = 600
+INVITES_CACHE_MAX_ENTRIES = 100000
+# Invites fetched at the same time, at most
+INVITES_FETCH_CONCURRENCY = 5
+
+
+class InviteRecord:
+    """
+    What we need to know about an invite, without keeping the whole discord.Invite around.
+    """
+    __slots__ = ('code', 'guild_id', 'guild_name', 'member_count', 'fetched_at')
+
+    def __init__(self, code: str, guild_id: typing.Optional[int], guild_name: str, member_count: int):
+        self.code = code
+        self.guild_id = guild_id
+        self.guild_name = guild_name
+        self.member_count = member_count
+        self.fetched_at = time.time()
+
+    @classmethod
+    def from_invite(cls, invite: discord.Invite) -> 'InviteRecord':
+        guild = invite.guild
+        return cls(invite.code,
+                   guild.id if guild is not None else None,
+                   guild.name if guild is not None else "(No server)",
+                   getattr(invite, 'approximate_member_count', None) or 0)
+
+
+# Cached for invalid codes. Caches treat None as a miss, so that can't be used
+INVALID_INVITE = InviteRecord("", None, "", 0)
+
+
+class InviteResolver:
+    """
+    Resolve invite codes to InviteRecords, caching invalid codes too.
+
+    A code is only fetched once at a time: everyone asking for a code that is being fetched waits for that fetch.
+    Outdated valid invites are still served while they are fetched again in the background, invalid ones aren't.
+    """
+
+    def __init__(self, bot: 'GetBeaned'):
+        self.bot = bot
+        self.cache = bot.cache.get_cache("invites_records", expire_after=2 * INVITES_CACHE_EXPIRE, strict=True,
+                                         max_entries=INVITES_CACHE_MAX_ENTRIES, eviction_policy="lru")
+        self.fetching: typing.Dict[str, asyncio.Future] = {}
+        self.fetch_semaphore = asyncio.Semaphore(INVITES_FETCH_CONCURRENCY)
+        self.fetches = 0
+
+    async def fetch(self, code: str) -> InviteRecord:
+        async with self.fetch_semaphore:
+            self.fetches += 1
+            try:
+                invite = await self.bot.fetch_invite(code, with_counts=True)
+            except discord.errors.NotFound:
+                return INVALID_INVITE
+
+        return InviteRecord.from_invite(invite)
+
+    async def fetch_and_store(self, code: str) -> InviteRecord:
+        record = await self.fetch(code)
+        self.cache[code] = record
+        if record is INVALID_INVITE:
+            self.cache.reset_expiry(code, INVALID_INVITES_CACHE_EXPIRE)
+        return record
+
+    def get_fetch(self, code: str) -> asyncio.Future:
+        """
+        The fetch of a code in progress, started if there is none.
+        """
+        future = self.fetching.get(code)
+        if future is None:
+            future = self.fetching[code] = asyncio.ensure_future(self.fetch_and_store(code))
+            future.add_done_callback(functools.partial(self.fetch_done, code))
+        return future
+
+    def fetch_done(self, code: str, future: asyncio.Future):
+        del self.fetching[code]
+        # Retrieving the exception here is needed for background refreshes that nobody waits on
+        if not future.cancelled() and future.exception() is not None:
+            self.bot.logger.debug(f"Fetching invite code {code} failed: {future.exception()!r}")
+
+    async def resolve(self, code: str) -> typing.Optional[InviteRecord]:
+        """
+        Record of an invite code, or None if the code is invalid. Other errors while fetching it are raised.
+        """
+        record = self.cache[code]
+
+        if record is None:
+            # Don't cancel the fetch for everyone waiting on it if this one is cancelled
+            record = await asyncio.shield(self.get_fetch(code))
+        elif record is not INVALID_INVITE and time.time() > record.fetched_at + INVITES_CACHE_EXPIRE:
+            self.get_fetch(code)
+
+        if record is INVALID_INVITE:
+            return None
+        return record
+
+    async def resolve_many(self, codes: typing.Iterable[str]) -> typing.Dict[str, typing.Union[InviteRecord, None, Exception]]:
+        """
+        Resolve codes concurrently. The result for a code is its record, None if it's invalid, or the exception raised
+        while fetching it.
+        """
+        codes = list(dict.fromkeys(codes))
+        results = await asyncio.gather(*(self.resolve(code) for code in codes), return_exceptions=True)
+        return dict(zip(codes, results))
@@ -0,0 +1,151 @@
+import time
+import typing
+
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+# Joins are remembered for that long, and at most that many per guild
+JOINS_WINDOW_DURATION = 600
+JOINS_WINDOW_CAPACITY = 1000
+
+
+class JoinsWindow:
+    """
+    Sliding window of the members who joined a guild recently, in join order.
+
+    Joins are stored in a ring buffer, and the window keeps, for the whole duration and for each shorter duration it
+    was asked about, where the joins within it start. These only move forward as time passes, so adding a join and
+    counting the joins of the last N seconds are O(1) amortized, however many joins there are.
+
+    A join already in the window isn't added again, but a member who left and joined again is a new join. Members are
+    also indexed by avatar, to find accounts sharing it without going thru the whole window.
+    """
+
+    def __init__(self, duration: float = JOINS_WINDOW_DURATION, capacity: int = JOINS_WINDOW_CAPACITY):
+        self.duration = duration
+        self.capacity = capacity
+        self.times: typing.List[float] = [0.0] * capacity
+        self.members: typing.List[typing.Optional[discord.Member]] = [None] * capacity
+        # Avatars as they were on join, discord.py updates members in place
+        self.members_avatars: typing.List[typing.Optional[str]] = [None] * capacity
+        # (member id, joined at) of each join, like MassActionsExecutor
+        self.joins_keys: typing.List[typing.Optional[tuple]] = [None] * capacity
+        self.joins_keys_set: typing.Set[tuple] = set()
+        # avatar hash -> {join key: member}, in join order
+        self.avatars: typing.Dict[str, typing.Dict[tuple, discord.Member]] = {}
+
+        # Joins are numbered in order. total is the number of the next join, oldest the one of the oldest kept join
+        self.total = 0
+        self.oldest = 0
+        # duration -> number of the oldest join within it
+        self.starts: typing.Dict[float, int] = {}
+
+    def __len__(self):
+        return self.count()
+
+    def drop_oldest(self):
+        index = self.oldest % self.capacity
+        avatar, key = self.members_avatars[index], self.joins_keys[index]
+        self.joins_keys_set.discard(key)
+
+        if avatar is not None:
+            same_avatar = self.avatars[avatar]
+            del same_avatar[key]
+            if not same_avatar:
+                del self.avatars[avatar]
+
+        self.members[index] = None
+        self.members_avatars[index] = None
+        self.joins_keys[index] = None
+        self.oldest += 1
+
+    def expire(self, now: float):
+        times, capacity = self.times, self.capacity
+
+        while self.oldest < self.total and times[self.oldest % capacity] < now - self.duration:
+            self.drop_oldest()
+
+        for duration, start in self.starts.items():
+            start = max(start, self.oldest)
+            while start < self.total and times[start % capacity] < now - duration:
+                start += 1
+            self.starts[duration] = start
+
+    def add(self, member: discord.Member, now: float = None) -> bool:
+        """
+        Add a join to the window. Returns False if that join was already in it.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+
+        key = (member.id, member.joined_at)
+        if key in self.joins_keys_set:
+            return False
+
+        if self.total - self.oldest == self.capacity:
+            self.drop_oldest()
+
+        index = self.total % self.capacity
+        self.times[index] = now
+        self.members[index] = member
+        self.members_avatars[index] = member.avatar
+        self.joins_keys[index] = key
+        self.joins_keys_set.add(key)
+        if member.avatar is not None:
+            self.avatars.setdefault(member.avatar, {})[key] = member
+        self.total += 1
+        return True
+
+    def start(self, seconds: typing.Optional[float], now: float = None) -> int:
+        if seconds is not None and seconds not in self.starts:
+            self.starts[seconds] = self.oldest
+        self.expire(time.time() if now is None else now)
+        return self.oldest if seconds is None else self.starts[seconds]
+
+    def count(self, seconds: float = None) -> int:
+        """
+        Number of joins in the last `seconds` (by default, in the whole window).
+        """
+        return self.total - self.start(seconds)
+
+    def members_since(self, seconds: float = None) -> typing.List[discord.Member]:
+        """
+        Members who joined in the last `seconds` (by default, in the whole window), oldest first.
+        """
+        return [self.members[number % self.capacity] for number in range(self.start(seconds), self.total)]
+
+    def with_avatar(self, avatar: str) -> typing.List[discord.Member]:
+        """
+        Members in the window with this avatar hash, oldest first.
+        """
+        self.expire(time.time())
+        return list(self.avatars.get(avatar, {}).values())
+
+    def latest(self, n: int) -> typing.List[discord.Member]:
+        """
+        Last `n` members who joined, oldest first.
+        """
+        start = max(self.start(None), self.total - n)
+        return [self.members[number % self.capacity] for number in range(start, self.total)]
+
+
+def get_joins_windows(bot: 'GetBeaned'):
+    """
+    Per guild joins windows, shared by every cog that needs to know about recent joins.
+    """
+    return bot.cache.get_cache("joins_windows", expire_after=JOINS_WINDOW_DURATION, default=JoinsWindow)
+
+
+def record_join(bot: 'GetBeaned', member: discord.Member) -> JoinsWindow:
+    """
+    Add a join to its guild window, and return the window. Cogs can all call this on join, the member is only added once.
+    Bots aren't added: they are invited by the moderators, not part of raids.
+    """
+    windows = get_joins_windows(bot)
+    window = windows[member.guild.id]
+    if not member.bot:
+        window.add(member)
+    windows.reset_expiry(member.guild.id)
+    return window
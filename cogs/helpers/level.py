@@ -4,6 +4,7 @@ import discord
 
 if typing.TYPE_CHECKING:
     from cogs.helpers.context import CustomContext
+    from cogs.helpers.GetBeaned import GetBeaned
 
 BANNED_MEMBERS_IDS = [
     556456702753636400,  # See https://getbeaned.me/actions/17049
@@ -24,8 +25,58 @@ MODERATORS_IDS = [
 ]
 
 
-# noinspection PyUnreachableCode
+# Levels of the members of a guild are all forgotten that long after the first one was computed, or sooner if their
+# roles, the guild roles permissions, owner or staff settings change.
+LEVELS_CACHE_EXPIRE = 600
+
+
+def get_levels_cache(bot: 'GetBeaned'):
+    # guild id -> {member id: level}
+    return bot.cache.get_cache("members_levels", expire_after=LEVELS_CACHE_EXPIRE, strict=True, default=dict)
+
+
+def invalidate_member_level(bot: 'GetBeaned', guild: discord.Guild, member_id: int):
+    levels = get_levels_cache(bot)
+    if guild.id in levels:
+        levels[guild.id].pop(member_id, None)
+
+
+def invalidate_guild_levels(bot: 'GetBeaned', guild: discord.Guild):
+    del get_levels_cache(bot)[guild.id]
+
+
+def get_cached_level(bot: 'GetBeaned', member: discord.Member) -> typing.Optional[int]:
+    """
+    Level of a member if it's known, without awaiting anything. None if it has to be computed with get_level.
+    """
+    guild = getattr(member, 'guild', None)
+    if guild is None:
+        return None
+
+    levels = get_levels_cache(bot)
+    if guild.id not in levels:
+        return None
+    return levels[guild.id].get(member.id)
+
+
 async def get_level(ctx: 'CustomContext', user: discord.Member):
+    """
+    Level of a user, see compute_level. Levels of guild members are cached.
+    """
+    level = get_cached_level(ctx.bot, user)
+    if level is not None:
+        return level
+
+    level = await compute_level(ctx, user)
+
+    if ctx.guild and getattr(user, 'guild', None) is not None:
+        get_levels_cache(ctx.bot)[user.guild.id][user.id] = level
+
+    return level
+
+
+# noinspection PyUnreachableCode
+async def compute_level(ctx: 'CustomContext', user: discord.Member):
     """
     Levels are a permission system so that you can access your level command and below.
 
@@ -81,42 +132,38 @@ async def get_level(ctx: 'CustomContext', user: discord.Member):
     if user.guild.owner == user:
         return 5
 
-    # Level 4
-    admins_ids = await ctx.bot.settings.get(user.guild, 'permissions_admins')
+    staff_ids = await ctx.bot.settings.get_staff_ids(user.guild)
+    roles_ids = frozenset(r.id for r in user.roles)
 
+    # Level 4
     if user.guild_permissions.administrator:
         return 4
-    elif user.id in admins_ids:
+    elif user.id in staff_ids.admins:
         return 4
-    elif set(admins_ids).intersection(set([r.id for r in user.roles])):
+    elif not staff_ids.admins.isdisjoint(roles_ids):
         return 4
 
     # Level 3
     # We need to be able to add moderators without giving them a discord permission.
     # We are checking permissions here (give a ban permission : members can use
     # the ban, softban commands, a kick permission for the kick, warns and note commands)
-    moderators_ids = await ctx.bot.settings.get(user.guild, 'permissions_moderators')
-
     if user.guild_permissions.ban_members:
         return 3
-    elif user.id in moderators_ids:
+    elif user.id in staff_ids.moderators:
         return 3
-    elif set(moderators_ids).intersection(set([r.id for r in user.roles])):
+    elif not staff_ids.moderators.isdisjoint(roles_ids):
         return 3
 
     # Level 2
     # This will basically be half-mods, that can user kick-permission commands, but can't ban or do much damage
-    trusted_ids = await ctx.bot.settings.get(user.guild, 'permissions_trusted')
-
     if user.guild_permissions.kick_members:
         return 2
-    elif user.id in trusted_ids:
+    elif user.id in staff_ids.trusted:
         return 2
-    elif set(trusted_ids).intersection(set([r.id for r in user.roles])):
+    elif not staff_ids.trusted.isdisjoint(roles_ids):
         return 2
 
-    banned_ids = await ctx.bot.settings.get(user.guild, 'permissions_banned')
-    if user.id in banned_ids or set(banned_ids).intersection(set([r.id for r in user.roles])):
+    if user.id in staff_ids.banned or not staff_ids.banned.isdisjoint(roles_ids):
         return 0
 
     # Level 1
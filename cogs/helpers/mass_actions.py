@@ -0,0 +1,94 @@
+import asyncio
+import time
+import typing
+
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+from cogs.helpers.actions import full_process
+from cogs.helpers.helpful_classes import LikeUser
+
+# Kicks and bans of a guild share Discord rate limits, so they are paced per guild to stay just under them instead of
+# hitting them and waiting for the 429s to clear.
+MASS_ACTIONS_RATE = 5
+MASS_ACTIONS_BURST = 10
+MASS_ACTIONS_CONCURRENCY = 10
+# How long the memberships acted on by a mass action are remembered, to skip them if they are in another batch
+MASS_ACTIONS_PROCESSED_EXPIRE = 600
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class MassActionsExecutor:
+    """
+    Act on many members of a guild at once (raids), concurrently but paced by a per-guild token bucket.
+
+    Members already acted on are skipped, so a member both in a raid batch and kicked on join is only kicked once.
+    """
+
+    def __init__(self, bot: 'GetBeaned'):
+        self.bot = bot
+        self.buckets = bot.cache.get_cache("mass_actions_buckets", expire_after=MASS_ACTIONS_PROCESSED_EXPIRE,
+                                           default=lambda: TokenBucket(MASS_ACTIONS_RATE, MASS_ACTIONS_BURST))
+        self.processed = bot.cache.get_cache("mass_actions_processed", expire_after=MASS_ACTIONS_PROCESSED_EXPIRE, default=set)
+
+    async def run(self, guild: discord.Guild, action_coroutine: typing.Callable[[discord.Member, str], typing.Awaitable],
+                  members: typing.List[discord.Member], moderator: LikeUser, reason: str, automod_logs: str = None) -> dict:
+        processed = self.processed[guild.id]
+        self.processed.reset_expiry(guild.id)
+
+        targets = []
+        for member in members:
+            # A member that was kicked and joined again is a new membership, that must be acted on again
+            membership = (member.id, getattr(member, 'joined_at', None))
+            if membership not in processed:
+                processed.add(membership)
+                targets.append(member)
+
+        bucket = self.buckets[guild.id]
+        self.buckets.reset_expiry(guild.id)
+        semaphore = asyncio.Semaphore(MASS_ACTIONS_CONCURRENCY)
+
+        async def act(member: discord.Member):
+            async with semaphore:
+                await bucket.acquire()
+                await full_process(self.bot, action_coroutine, member, moderator, reason=reason, automod_logs=automod_logs)
+
+        start = time.monotonic()
+        results = await asyncio.gather(*[act(member) for member in targets], return_exceptions=True)
+        elapsed = time.monotonic() - start
+
+        failed = 0
+        for member, result in zip(targets, results):
+            if isinstance(result, Exception):
+                failed += 1
+                self.bot.logger.warning(f"Mass {action_coroutine.__name__} of {member.id} on guild {guild.id} failed: {result!r}")
+
+        acted = len(targets) - failed
+        return {"acted": acted,
+                "failed": failed,
+                "skipped": len(members) - len(targets),
+                "elapsed": elapsed,
+                "throughput": acted / elapsed if elapsed > 0 else None}
@@ -0,0 +1,110 @@
+import collections
+import time
+import typing
+
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+# The automod remembers that many messages per author, for that long after their last message
+MESSAGE_HISTORY_LENGTH = 7
+MESSAGE_HISTORY_EXPIRE = 600
+MESSAGE_HISTORY_MAX_AUTHORS = 50000
+
+
+def content_hash(content: str) -> int:
+    return hash(content)
+
+
+class MessageRecord:
+    """
+    What the automod needs to remember about a message, instead of the message itself (and its author, mentions, embeds...)
+    """
+    __slots__ = ('content_hash', 'length', 'mentions_ids', 'timestamp', 'attachments_hashes')
+
+    def __init__(self, content_hash: int, length: int, mentions_ids: typing.Tuple[int, ...], timestamp: float,
+                 attachments_hashes: typing.Tuple[str, ...] = ()):
+        self.content_hash = content_hash
+        self.length = length
+        self.mentions_ids = mentions_ids
+        self.timestamp = timestamp
+        self.attachments_hashes = attachments_hashes
+
+    @classmethod
+    def from_message(cls, message: discord.Message, attachments_hashes: typing.Tuple[str, ...] = ()) -> 'MessageRecord':
+        author_id = message.author.id
+        return cls(content_hash(message.content),
+                   len(message.content),
+                   tuple(mention.id for mention in message.mentions if mention.id != author_id),
+                   time.time(),
+                   attachments_hashes)
+
+
+class AuthorHistory:
+    """
+    Last messages of an author. How many times each content and attachment was sent, and who was mentioned how many
+    times, are kept up to date as messages are added and pushed out, so checking a message doesn't go thru the history.
+    """
+    __slots__ = ('records', 'contents', 'attachments', 'mentions', 'mentions_total')
+
+    def __init__(self, length: int = MESSAGE_HISTORY_LENGTH):
+        self.records: typing.Deque[MessageRecord] = collections.deque(maxlen=length)
+        # content hash -> number of records with it
+        self.contents = collections.Counter()
+        # attachment hash -> number of records with it
+        self.attachments = collections.Counter()
+        # mentioned user id -> number of mentions
+        self.mentions = collections.Counter()
+        self.mentions_total = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, record: MessageRecord):
+        if len(self.records) == self.records.maxlen:
+            self.forget(self.records[0])
+
+        self.records.append(record)
+        self.contents[record.content_hash] += 1
+        self.attachments.update(record.attachments_hashes)
+        self.mentions.update(record.mentions_ids)
+        self.mentions_total += len(record.mentions_ids)
+
+    def forget(self, record: MessageRecord):
+        self.contents[record.content_hash] -= 1
+        if not self.contents[record.content_hash]:
+            del self.contents[record.content_hash]
+
+        for attachment_hash in record.attachments_hashes:
+            self.attachments[attachment_hash] -= 1
+            if not self.attachments[attachment_hash]:
+                del self.attachments[attachment_hash]
+
+        for mention_id in record.mentions_ids:
+            self.mentions[mention_id] -= 1
+            if not self.mentions[mention_id]:
+                del self.mentions[mention_id]
+        self.mentions_total -= len(record.mentions_ids)
+
+    def repeats(self, content: str) -> int:
+        """
+        Number of messages in the history with exactly this content.
+        """
+        return self.contents.get(content_hash(content), 0)
+
+    def attachments_repeats(self, attachments_hashes: typing.Iterable[str]) -> int:
+        """
+        Most messages in the history with one of these attachments.
+        """
+        return max((self.attachments.get(attachment_hash, 0) for attachment_hash in attachments_hashes), default=0)
+
+    @property
+    def mentioned_users(self) -> int:
+        return len(self.mentions)
+
+
+def get_messages_history(bot: 'GetBeaned'):
+    # author id -> AuthorHistory
+    return bot.cache.get_cache("automod_previous_messages", expire_after=MESSAGE_HISTORY_EXPIRE, default=AuthorHistory,
+                               max_entries=MESSAGE_HISTORY_MAX_AUTHORS, eviction_policy="lru")
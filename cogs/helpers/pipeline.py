@@ -0,0 +1,164 @@
+import asyncio
+import collections
+import statistics
+import time
+import typing
+
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+from cogs.helpers.level import get_cached_level
+
+# Messages are checked by that many workers per shard, and at most that many can wait per shard
+PIPELINE_WORKERS_PER_SHARD = 8
+PIPELINE_MAX_PENDING_PER_SHARD = 5000
+# Once that many messages are waiting on a shard, messages from members of at least that level are not checked
+PIPELINE_PRESSURE_PENDING = 1000
+PIPELINE_SHED_LEVEL = 2
+# How many recent wait/processing times are kept for the metrics
+PIPELINE_TIMINGS_KEPT = 1000
+
+
+class ShardPipeline:
+    """
+    Messages of a shard waiting to be checked, one queue per guild, served round-robin so that a guild with a lot of
+    messages (a raid) can't delay the messages of the others by more than one message each.
+    """
+
+    def __init__(self, pipeline: 'MessagesPipeline', shard_id: int):
+        self.pipeline = pipeline
+        self.shard_id = shard_id
+
+        # guild id -> [(enqueued at, message, edited), ...]
+        self.guilds: typing.Dict[int, typing.Deque[typing.Tuple[float, discord.Message, bool]]] = {}
+        # Guilds with messages waiting, in the order they will be served
+        self.ready: typing.Deque[int] = collections.deque()
+        self.pending = 0
+        self.available = asyncio.Semaphore(0)
+
+        self.submitted = 0
+        self.processed = 0
+        self.shed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_pending = 0
+        self.waits = collections.deque(maxlen=PIPELINE_TIMINGS_KEPT)
+        self.processing_times = collections.deque(maxlen=PIPELINE_TIMINGS_KEPT)
+
+        self.workers = [asyncio.ensure_future(self.work()) for _ in range(pipeline.workers_per_shard)]
+
+    def submit(self, message: discord.Message, edited: bool) -> bool:
+        """
+        Queue a message to be checked. Returns False if it was shed instead.
+        """
+        self.submitted += 1
+
+        if self.pending >= PIPELINE_PRESSURE_PENDING:
+            level = get_cached_level(self.pipeline.bot, message.author)
+            if level is not None and level >= PIPELINE_SHED_LEVEL:
+                self.shed += 1
+                return False
+
+        guild_id = message.guild.id
+        queue = self.guilds.get(guild_id)
+        if queue is None:
+            queue = self.guilds[guild_id] = collections.deque()
+            self.ready.append(guild_id)
+        queue.append((time.perf_counter(), message, edited))
+
+        if self.pending >= PIPELINE_MAX_PENDING_PER_SHARD:
+            # Full: drop the oldest message of the guild with the most waiting, which is the one flooding the shard
+            longest = max(self.guilds.values(), key=len)
+            longest.popleft()
+            self.dropped += 1
+        else:
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            self.available.release()
+
+        return True
+
+    def next_message(self) -> typing.Tuple[float, discord.Message, bool]:
+        while True:
+            guild_id = self.ready.popleft()
+            queue = self.guilds[guild_id]
+
+            if queue:
+                item = queue.popleft()
+            else:
+                item = None
+
+            if queue:
+                self.ready.append(guild_id)
+            else:
+                del self.guilds[guild_id]
+
+            if item is not None:
+                return item
+
+    async def work(self):
+        while True:
+            await self.available.acquire()
+            enqueued_at, message, edited = self.next_message()
+            self.pending -= 1
+
+            start = time.perf_counter()
+            self.waits.append(start - enqueued_at)
+            try:
+                await self.pipeline.handler(message, edited)
+            except Exception:
+                self.failed += 1
+                self.pipeline.bot.logger.exception(f"Checking message {message.id} failed")
+            finally:
+                self.processed += 1
+                self.processing_times.append(time.perf_counter() - start)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+
+    def get_status(self) -> dict:
+        def percentile(values, q):
+            if not values:
+                return 0
+            values = sorted(values)
+            return values[int(q * (len(values) - 1))]
+
+        return {"pending": self.pending,
+                "max_pending": self.max_pending,
+                "guilds_pending": len(self.guilds),
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "shed": self.shed,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "wait_mean": statistics.mean(self.waits) if self.waits else 0,
+                "wait_p99": percentile(self.waits, 0.99),
+                "processing_p50": percentile(self.processing_times, 0.50),
+                "processing_p99": percentile(self.processing_times, 0.99)}
+
+
+class MessagesPipeline:
+    """
+    Bounded queues of messages, checked by a fixed pool of workers per shard, instead of a task per message.
+    """
+
+    def __init__(self, bot: 'GetBeaned', handler: typing.Callable[[discord.Message, bool], typing.Awaitable],
+                 workers_per_shard: int = PIPELINE_WORKERS_PER_SHARD):
+        self.bot = bot
+        self.handler = handler
+        self.workers_per_shard = workers_per_shard
+        self.shards: typing.Dict[int, ShardPipeline] = {}
+
+    def submit(self, message: discord.Message, edited: bool = False) -> bool:
+        shard_id = message.guild.shard_id
+        shard = self.shards.get(shard_id)
+        if shard is None:
+            shard = self.shards[shard_id] = ShardPipeline(self, shard_id)
+        return shard.submit(message, edited)
+
+    def stop(self):
+        for shard in self.shards.values():
+            shard.stop()
@@ -0,0 +1,53 @@
+import re
+import typing
+
+import discord
+
+if typing.TYPE_CHECKING:
+    from cogs.helpers.GetBeaned import GetBeaned
+
+# Channels can opt in or out of some features by adding [getbeaned:flag_name] to their topic
+TOPIC_FLAG_REGEX = re.compile(r"\[getbeaned:([a-z_]+)\]")
+
+
+class TopicFlags:
+    """
+    The [getbeaned:...] flags of a channel topic, parsed once for all the events in that channel.
+    """
+    __slots__ = ('topic', 'disable_automod', 'enable_automod', 'disable_invite_detection', 'disable_spam_detection',
+                 'disable_logging', 'auto_publish')
+
+    def __init__(self, topic: typing.Optional[str]):
+        self.topic = topic
+        flags = set(TOPIC_FLAG_REGEX.findall(topic or ""))
+
+        self.disable_automod = 'disable_automod' in flags
+        self.enable_automod = 'enable_automod' in flags
+        self.disable_invite_detection = 'disable_invite_detection' in flags
+        self.disable_spam_detection = 'disable_spam_detection' in flags
+        self.disable_logging = 'disable_logging' in flags
+        self.auto_publish = 'auto_publish' in flags
+
+
+NO_TOPIC_FLAGS = TopicFlags(None)
+
+
+def get_topic_flags_cache(bot: 'GetBeaned'):
+    # channel id -> TopicFlags
+    return bot.cache.get_cache("topic_flags", expire_after=3600, max_entries=100000, eviction_policy="lru")
+
+
+def get_topic_flags(bot: 'GetBeaned', channel: discord.abc.Messageable) -> TopicFlags:
+    topic = getattr(channel, 'topic', None)
+    if not topic:
+        return NO_TOPIC_FLAGS
+
+    cache = get_topic_flags_cache(bot)
+    flags = cache.get(channel.id)
+
+    # discord.py replaces the topic string when it changes, so an updated topic is never the cached one
+    if flags is None or flags.topic is not topic:
+        flags = TopicFlags(topic)
+        cache[channel.id] = flags
+
+    return flags
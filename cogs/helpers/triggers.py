@@ -2,12 +2,13 @@
 This file is meant to keep code for AutoTriggers, so that the automod file isn't too big
 Everything here should be imported by automod if enabled
 """
+import collections
 import datetime
 import re
 import sys
 import traceback
 import typing
-from typing import List
+from typing import List, Dict, Set
 
 import discord
 import ftfy
@@ -16,7 +17,117 @@ if typing.TYPE_CHECKING:
     from cogs.automod import CheckMessage
 
 
+class PhrasesAutomaton:
+    """
+    Aho-Corasick automaton: finds which ones of a (possibly big) list of phrases are in a text, in a single pass over
+    the text, whatever the number of phrases.
+    """
+
+    def __init__(self, phrases: typing.Iterable[str]):
+        self.transitions: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[typing.Tuple[str, ...]] = [()]
+
+        for phrase in set(phrases):
+            node = 0
+            for char in phrase:
+                next_node = self.transitions[node].get(char)
+                if next_node is None:
+                    next_node = len(self.transitions)
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                    self.transitions[node][char] = next_node
+                node = next_node
+            self.outputs[node] = (phrase, )
+
+        # Breadth first, so that the fail link of a node parent is always computed before the node
+        queue = collections.deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.transitions[node].items():
+                queue.append(child)
+
+                fallback = self.fail[node]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def search(self, text: str) -> Set[str]:
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        found = set()
+        node = 0
+
+        for char in text:
+            while node and char not in transitions[node]:
+                node = fail[node]
+            node = transitions[node].get(char, 0)
+            if outputs[node]:
+                found.update(outputs[node])
+
+        return found
+
+
+class TriggersPhrasesMatcher:
+    """
+    Every AutoTrigger phrases, compiled once, so that a message is normalized and scanned once for all the triggers.
+
+    scan() returns, for each trigger, how many of its phrases are in the message. Like message_contains_x_of, a phrase
+    listed twice in a trigger counts twice.
+    """
+
+    def __init__(self, triggers: typing.Iterable[typing.Type['AutoTrigger']]):
+        # normalize -> automaton
+        self.automatons: Dict[bool, PhrasesAutomaton] = {}
+        # normalize -> phrase -> [(trigger, times the phrase is listed in the trigger), ...]
+        self.phrases_triggers: Dict[bool, Dict[str, List[typing.Tuple[typing.Type['AutoTrigger'], int]]]] = {}
+        # normalize -> triggers with phrases in that automaton
+        self.triggers: Dict[bool, typing.FrozenSet[typing.Type['AutoTrigger']]] = {}
+
+        for normalize in (False, True):
+            phrases_triggers = collections.defaultdict(list)
+            for trigger in triggers:
+                if trigger.normalize_phrases == normalize:
+                    for phrase, count in collections.Counter(phrase.lower() for phrase in trigger.phrases).items():
+                        phrases_triggers[phrase].append((trigger, count))
+
+            if phrases_triggers:
+                self.phrases_triggers[normalize] = dict(phrases_triggers)
+                self.automatons[normalize] = PhrasesAutomaton(phrases_triggers.keys())
+                self.triggers[normalize] = frozenset(trigger for trigger in triggers if trigger.normalize_phrases == normalize)
+
+    def scan(self, content: str, triggers: typing.Iterable[typing.Type['AutoTrigger']] = None) -> Dict[typing.Type['AutoTrigger'], int]:
+        """
+        If `triggers` is given, only look for their phrases: the message isn't normalized if none of them needs it.
+        """
+        hits = collections.Counter()
+        triggers = None if triggers is None else frozenset(triggers)
+
+        for normalize, automaton in self.automatons.items():
+            if triggers is not None and triggers.isdisjoint(self.triggers[normalize]):
+                continue
+
+            if normalize:
+                text = ftfy.fix_text(content, normalization='NFKC').lower().strip()
+            else:
+                text = content.lower().strip()
+
+            phrases_triggers = self.phrases_triggers[normalize]
+            for phrase in automaton.search(text):
+                for trigger, count in phrases_triggers[phrase]:
+                    hits[trigger] += count
+
+        return hits
+
+
 class AutoTrigger:
+    # Phrases looked for in messages, how many of them must be found for the trigger to match, and whether the message
+    # should be normalized with ftfy before looking for them
+    phrases: List[str] = []
+    phrases_needed = 1
+    normalize_phrases = False
+
     def __init__(self, message: 'CheckMessage'):
         self.check_message = message
         self.message = message.message
@@ -24,14 +135,19 @@ class AutoTrigger:
         self.autotrigger_dbname = "generic"
 
     async def is_enabled(self) -> bool:
-        pref_name = f"autotrigger_{self.autotrigger_dbname}_score"
-
-        return (await self.check_message.bot.settings.get(self.message.guild, pref_name)) != 0
+        return self.check_message.policy.autotriggers_scores[self.autotrigger_dbname] != 0
 
     async def get_score(self) -> float:
-        pref_name = f"autotrigger_{self.autotrigger_dbname}_score"
+        return self.check_message.policy.autotriggers_scores[self.autotrigger_dbname]
+
+    async def contains_phrases(self) -> bool:
+        hits = self.check_message.phrases_hits
+
+        if hits is None:
+            # The message wasn't scanned in advance
+            return await message_contains_x_of(self.message, self.phrases_needed, self.phrases, normalize=self.normalize_phrases)
 
-        return await self.check_message.bot.settings.get(self.message.guild, pref_name)
+        return hits[type(self)] >= self.phrases_needed
 
     async def check(self) -> bool:
         return False
@@ -63,72 +179,79 @@ class AutoTrigger:
 
 
 class BadStrings(AutoTrigger):
+    # There are a tons of characters in there
+    phrases = ["بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹 بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹",
+               "بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹 بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹",
+               "بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ",
+               "بٍٍٍرٍٍٍآٍٍٍ"]
+
     def __init__(self, message):
         super().__init__(message)
         self.autotrigger_name = "Bad Strings"
         self.autotrigger_dbname = "badstrings"
 
     async def check(self):
-        # There are a tons of characters in there
-        assert await message_contains_any(self.message,
-                                          ["بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹 بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹",
-                                           "بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹 بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ🇮🇹",
-                                           "بٍٍٍٍََُُُِّّّْرٍٍٍٍََُُِِّّّْآٍٍٍَُّ",
-                                           "بٍٍٍرٍٍٍآٍٍٍ"])
+        assert await self.contains_phrases()
         return True
 
 
 class LibraCryptoDiscordBots(AutoTrigger):
+    # Notice the weird i
+    phrases = ["christmas airdrop",
+               "airdrop",
+               "air drop",
+               "airdrop",
+               "air drop",
+               "https://etherairdrop.io/",
+               "worked for me so its legit",
+               "Ethereum 2.0 Airdrop",
+               "heres the official tweet",
+               "dont miss the current 1INCH",
+               "okey that im sharing this but i claimed 1200$",
+               "i got 1400 dollars worth of 1inch tokens",
+               "1inch",
+               "1inch-airdrop.net",
+               "etherаirdrop.net",
+               "ethereum аirdrop",
+               "ethereum-airdrop.io"]
+    phrases_needed = 2
+    normalize_phrases = True
+
     def __init__(self, message):
         super().__init__(message)
         self.autotrigger_name = "Libra Discord Bots"
         self.autotrigger_dbname = "libradiscordbots"
 
     async def check(self):
-        # Notice the weird i
-        assert await message_contains_x_of(self.message, 2,
-                                          ["christmas airdrop",
-                                           "airdrop",
-                                           "air drop",
-                                           "airdrop",
-                                           "air drop",
-                                           "https://etherairdrop.io/",
-                                           "worked for me so its legit",
-                                           "Ethereum 2.0 Airdrop",
-                                           "heres the official tweet",
-                                           "dont miss the current 1INCH",
-                                           "okey that im sharing this but i claimed 1200$",
-                                           "i got 1400 dollars worth of 1inch tokens",
-                                           "1inch",
-                                           "1inch-airdrop.net",
-                                           "etherаirdrop.net",
-                                           "ethereum аirdrop",
-                                           "ethereum-airdrop.io"], normalize=True)
-
+        assert await self.contains_phrases()
         assert await member_joined_x_days_ago(self.message.author, x=2)
         return True
 
 
 class DMMeNudesDiscordBots(AutoTrigger):
+    phrases = ["Dm me guys if you want to see my nudes for free", "Dm me guys if you want to see my nudes for  free"]
+
     def __init__(self, message):
         super().__init__(message)
         self.autotrigger_name = "Nudes Selling Discord Bots"
         self.autotrigger_dbname = "sexdatingdiscordbots"
 
     async def check(self):
-        assert await message_contains_any(self.message, ["Dm me guys if you want to see my nudes for free", "Dm me guys if you want to see my nudes for  free"])
+        assert await self.contains_phrases()
         assert await member_joined_x_hours_ago(self.message.author, x=1)
         return True
 
 
 class SexDatingDiscordBots(AutoTrigger):
+    phrases = ["discord.amazingsexdating.com", "Sex dating discord >", "Sex Dating >", "Best casino online >", "adultheroesofhentai.cf", "one of the best hentai games - free for adults now!"]
+
     def __init__(self, message):
         super().__init__(message)
         self.autotrigger_name = "Sex Dating Discord Bots"
         self.autotrigger_dbname = "sexdatingdiscordbots"
 
     async def check(self):
-        assert await message_contains_any(self.message, ["discord.amazingsexdating.com", "Sex dating discord >", "Sex Dating >", "Best casino online >", "adultheroesofhentai.cf", "one of the best hentai games - free for adults now!"])
+        assert await self.contains_phrases()
         assert await user_dont_have_a_profile_picture(self.message.author)
         assert await member_joined_x_days_ago(self.message.author, x=1)
         return True
@@ -138,16 +261,18 @@ class SexDatingDiscordBots(AutoTrigger):
 # http://cool-essay.ga - Order essay writing online! Smarter and faster than your profs!
 # http://write-some.ga/ - From admission essays to graduate dissertations - rely on a trusted service to do it for you!
 class InstantEssayDiscordBots(AutoTrigger):
+    phrases = ["write-me-tender.ml", "cool-essay.ga", "essay", "writers", "profs", "order essay", "instant essay",
+               "Instant Essay Writing Service!", "Order essay writing online!", "Best Prices - Best Writers !", "write-some.ga",
+               "admission essays", "graduate dissertations"]
+    phrases_needed = 4
+
     def __init__(self, message):
         super().__init__(message)
         self.autotrigger_name = "Instant Essay Discord Bots"
         self.autotrigger_dbname = "instantessaydiscordbots"
 
     async def check(self):
-        assert await message_contains_x_of(self.message, 4, ["write-me-tender.ml", "cool-essay.ga", "essay", "writers", "profs", "order essay", "instant essay",
-                                                             "Instant Essay Writing Service!", "Order essay writing online!", "Best Prices - Best Writers !", "write-some.ga",
-                                                             "admission essays", "graduate dissertations"])
-
+        assert await self.contains_phrases()
         assert await member_joined_x_days_ago(self.message.author, x=1)
         assert await user_created_x_days_ago(self.message.author, x=3)
         assert not await user_have_nitro(self.message.author)
@@ -157,15 +282,16 @@ class InstantEssayDiscordBots(AutoTrigger):
 
 # :heart_eyes: 🥰 My 18+ photos :stuck_out_tongue_winking_eye: - https://www.nakedphotos.club/
 class SexBots(AutoTrigger):
+    phrases = ["privatepage.vip", "nakedphotos.club", "viewc.site", "My naked photos", "My 18+ photos", "Awesome Gift of the Day",
+               "https://bit.ly/KittyKiss"]
+
     def __init__(self, message):
         super().__init__(message)
         self.autotrigger_name = "Sex Bots"
         self.autotrigger_dbname = "sexbots"
 
     async def check(self):
-        assert await message_contains_x_of(self.message, 1, ["privatepage.vip", "nakedphotos.club", "viewc.site", "My naked photos", "My 18+ photos", "Awesome Gift of the Day",
-                                                             "https://bit.ly/KittyKiss"])
-
+        assert await self.contains_phrases()
         assert await member_joined_x_days_ago(self.message.author, x=2)
 
         # If the account is not that old or if it's matching the name pattern.
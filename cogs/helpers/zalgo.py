@@ -0,0 +1,76 @@
+"""
+Zalgo detection, used by the AutoMod.
+
+Zalgo text is made of characters stacked with a lot of combining marks (unicode categories Mn and Me). Each word is
+scored with its proportion of combining marks, and a message is zalgo if the 75th percentile of its words scores is
+over ZALGO_THRESHOLD.
+"""
+import re
+import typing
+import unicodedata
+
+ZALGO_CHAR_CATEGORIES = ('Mn', 'Me')
+ZALGO_THRESHOLD = 0.5
+
+# Planes 2 to 13 and 15 to 16 are CJK ideographs, unassigned or private use, without any combining mark. Skipping them
+# saves most of the time needed to build the tables below at import.
+PLANES_WITH_COMBINING_MARKS = (range(0x00000, 0x20000), range(0xE0000, 0xF0000))
+
+COMBINING_MARKS = [chr(codepoint) for planes in PLANES_WITH_COMBINING_MARKS for codepoint in planes
+                   if unicodedata.category(chr(codepoint)) in ZALGO_CHAR_CATEGORIES]
+
+
+def character_class(characters: typing.List[str]) -> str:
+    """
+    Regex character class matching the given (sorted) characters, as ranges of consecutive characters.
+    """
+    ranges = []
+    for character in characters:
+        if ranges and ord(character) == ord(ranges[-1][1]) + 1:
+            ranges[-1][1] = character
+        else:
+            ranges.append([character, character])
+
+    return "[" + "".join(re.escape(start) if start == end else f"{re.escape(start)}-{re.escape(end)}" for start, end in ranges) + "]"
+
+
+# Finding if there may be a combining mark in a message is a single regex search. It matches the combining marks of the
+# Basic Multilingual Plane, and any character outside of it (emojis, mostly): the regex engine uses a fast bitmap for BMP
+# characters, but has to go thru the ranges one by one for the others, which is way slower than checking them later.
+BMP_COMBINING_MARKS = [mark for mark in COMBINING_MARKS if ord(mark) <= 0xFFFF]
+MAYBE_COMBINING_MARKS_REGEX = re.compile(character_class(BMP_COMBINING_MARKS)[:-1] + "\U00010000-\U0010FFFF]")
+
+# str.translate table deleting every combining mark. Counting the marks in a string is then just comparing its length
+# before and after translating it, without going thru every character in python.
+COMBINING_MARKS_DELETION_TABLE = {ord(mark): None for mark in COMBINING_MARKS}
+
+
+def count_combining_marks(text: str) -> int:
+    return len(text) - len(text.translate(COMBINING_MARKS_DELETION_TABLE))
+
+
+def percentile(values: typing.List[float], q: float) -> float:
+    """
+    Same as numpy.percentile(values, q) with the default (linear) interpolation, without the numpy overhead that
+    dominates for the few values we have.
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    fraction = position - lower
+    return values[lower] + (values[upper] - values[lower]) * fraction
+
+
+def zalgo_score(message: str) -> typing.Tuple[bool, float]:
+    if len(message) == 0:
+        return False, 0
+
+    # Most messages have no combining marks at all, no need to split them in words then.
+    if MAYBE_COMBINING_MARKS_REGEX.search(message) is None:
+        return False, 0.0
+
+    word_scores = [count_combining_marks(word) / len(word) for word in message.split()]
+    total_score = percentile(word_scores, 75)
+
+    return total_score > ZALGO_THRESHOLD, total_score
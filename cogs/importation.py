@@ -1,3 +1,5 @@
+import asyncio
+import os
 import typing
 
 import discord
@@ -10,6 +12,9 @@ from cogs.helpers import checks
 from cogs.helpers.helpful_classes import LikeUser
 from cogs.helpers.context import CustomContext
 
+# Users already imported for guilds with a bans import in progress, so that an interrupted import can be resumed
+BANS_IMPORTS_CHECKPOINTS_DIRECTORY = "bans_imports_checkpoints"
+
 
 class Importation(commands.Cog):
 
@@ -21,41 +26,101 @@ class Importation(commands.Cog):
     @commands.guild_only()
     @checks.have_required_level(4)
     @checks.bot_have_minimal_permissions()
+    @commands.max_concurrency(1, commands.BucketType.guild)
     async def import_bans(self, ctx: 'CustomContext'):
         """
         Import bans from the server banlist. If possible and available, also include the reason from the audit logs.
 
-        This is only available to servers administrators, and can only be done once per guild.
+        This is only available to servers administrators, and can only be done once per guild (an interrupted import can be resumed).
         :param ctx:
         :return:
         """
 
-        if await self.bot.settings.get(ctx.guild, 'imported_bans'):
-            await ctx.send("You already imported your guild bans. "
-                           "If you think this is an error, join the support server and ask!")
-            return
-        else:
-            await self.bot.settings.set(ctx.guild, 'imported_bans', True)
+        checkpoint = self.load_checkpoint(ctx.guild)
 
-        await ctx.send(f"Doing that, it may take a long time, please wait!")
+        if checkpoint is None:
+            if await self.bot.settings.get(ctx.guild, 'imported_bans'):
+                await ctx.send("You already imported your guild bans. "
+                               "If you think this is an error, join the support server and ask!")
+                return
+            else:
+                await self.bot.settings.set(ctx.guild, 'imported_bans', True)
+                checkpoint = set()
+                await self.save_checkpoint(ctx.guild, [])
+
+            await ctx.send(f"Doing that, it may take a long time, please wait!")
+        else:
+            await ctx.send(f"Resuming the previous import ({len(checkpoint)} bans were already imported), please wait!")
 
         bans = await ctx.guild.bans()
 
-        i = 0
-        t = len(bans)
+        actions = []
         for ban in bans:
+            if ban.user.id in checkpoint:
+                continue
 
-            user = ban.user
             reason = ban.reason
 
             if not reason:
                 reason = "No reason was provided in the audit logs"
 
-            await self.api.add_action(ctx.guild, user, 'ban', reason,
-                                      responsible_moderator=LikeUser(did=0, name="BanList Import", guild=ctx.guild))
-            i += 1
+            actions.append((ban.user, 'ban', reason))
+
+        i = len(bans) - len(actions)
+        failed = 0
+        t = len(bans)
+
+        progress_message = await ctx.send(f"{i}/{t} bans imported from the server ban list...")
+        moderator = LikeUser(did=0, name="BanList Import", guild=ctx.guild)
+
+        async for users, results in self.api.add_actions_bulk(ctx.guild, actions, responsible_moderator=moderator):
+            imported_users_ids = []
+            for user, result in zip(users, results):
+                if isinstance(result, Exception):
+                    ctx.logger.warning(f"Importing the ban of {user.id} failed: {result!r}")
+                    failed += 1
+                else:
+                    imported_users_ids.append(user.id)
+                    i += 1
+
+            await self.save_checkpoint(ctx.guild, imported_users_ids)
+            await progress_message.edit(content=f"{i}/{t} bans imported from the server ban list...")
+
+        if failed:
+            await ctx.send(f"{i}/{t} bans imported from the server ban list. {failed} failed, run the command again to retry them.")
+        else:
+            self.delete_checkpoint(ctx.guild)
+            await ctx.send(f"{i}/{t} bans imported from the server ban list.")
+
+    @staticmethod
+    def checkpoint_path(guild: discord.Guild) -> str:
+        return os.path.join(BANS_IMPORTS_CHECKPOINTS_DIRECTORY, f"{guild.id}.txt")
+
+    def load_checkpoint(self, guild: discord.Guild) -> typing.Optional[typing.Set[int]]:
+        try:
+            with open(self.checkpoint_path(guild), "r") as f:
+                # A crash can leave the last line half written, that user will simply be imported again
+                return {int(line) for line in f if line.strip().isdigit() and line.endswith("\n")}
+        except FileNotFoundError:
+            return None
+
+    def append_to_checkpoint(self, guild: discord.Guild, imported_users_ids: typing.List[int]):
+        os.makedirs(BANS_IMPORTS_CHECKPOINTS_DIRECTORY, exist_ok=True)
+
+        with open(self.checkpoint_path(guild), "a") as f:
+            f.writelines(f"{user_id}\n" for user_id in imported_users_ids)
+
+    async def save_checkpoint(self, guild: discord.Guild, imported_users_ids: typing.List[int]):
+        """
+        Add users to the checkpoint of the guild (one id per line, only the new ones are written), off the event loop.
+        """
+        await asyncio.get_event_loop().run_in_executor(None, self.append_to_checkpoint, guild, imported_users_ids)
 
-        await ctx.send(f"{i}/{t} bans imported from the server ban list.")
+    def delete_checkpoint(self, guild: discord.Guild):
+        try:
+            os.remove(self.checkpoint_path(guild))
+        except FileNotFoundError:
+            pass
 
     @commands.command()
     @commands.guild_only()
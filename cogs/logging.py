@@ -19,9 +19,16 @@ from discord.ext import commands
 from cogs.helpers import context, checks
 from cogs.helpers.hastebins import upload_text
 from cogs.helpers.context import CustomContext
+from cogs.helpers.topic_flags import get_topic_flags
 
 ATTACHMENTS_UPLOAD_CHANNEL_ID = 624129637928140802
 
+LOGGING_PERMISSIONS = checks.permissions_mask(
+    send_messages=True,
+    embed_links=True,
+    attach_files=True,
+)
+
 
 async def save_attachments(bot: 'GetBeaned', message: discord.Message):
     if len(message.attachments) >= 1:
@@ -74,19 +81,14 @@ class Logging(commands.Cog):
     def __init__(self, bot: 'GetBeaned'):
         self.bot = bot
         self.api = bot.api
-        self.snipes = bot.cache.get_cache("logging_deleted_messages", expire_after=7200, default=lambda: collections.deque(maxlen=15))  # channel: [message, message]
+        self.snipes = bot.cache.get_cache("logging_deleted_messages", expire_after=7200, default=lambda: collections.deque(maxlen=15),
+                                          max_entries=20000, eviction_policy="lru")  # channel: [message, message]
 
     async def perms_okay(self, channel: discord.TextChannel):
-        wanted_permissions = discord.permissions.Permissions.none()
-        wanted_permissions.update(
-            send_messages=True,
-            embed_links=True,
-            attach_files=True,
-        )
-
-        my_permissions = channel.guild.me.permissions_in(channel)
+        my_permissions = checks.bot_permissions_in(self.bot, channel)
 
-        return my_permissions.is_strict_superset(wanted_permissions)
+        # Strict superset
+        return my_permissions & LOGGING_PERMISSIONS == LOGGING_PERMISSIONS and my_permissions != LOGGING_PERMISSIONS
 
     async def get_logging_channel(self, guild: discord.Guild, pref: str):
         # Beware to see if the channel id is actually in the same server (to compare, we will see if the current server
@@ -133,7 +135,7 @@ class Logging(commands.Cog):
         if first_message.guild is None:
             return
 
-        if "[getbeaned:disable_logging]" in str(first_message.channel.topic):
+        if get_topic_flags(self.bot, first_message.channel).disable_logging:
             return
 
         logging_channel = await self.get_logging_channel(first_message.guild, 'logs_delete_channel_id')
@@ -218,7 +220,7 @@ class Logging(commands.Cog):
         if channel is None or isinstance(channel, discord.abc.PrivateChannel):
             return
 
-        if "[getbeaned:disable_logging]" in str(channel.topic):
+        if get_topic_flags(self.bot, channel).disable_logging:
             return
 
         guild = channel.guild
@@ -293,7 +295,7 @@ class Logging(commands.Cog):
         self.snipes[message.channel].append(message)
         self.snipes.reset_expiry(message.channel)
 
-        if "[getbeaned:disable_logging]" in str(message.channel.topic):
+        if get_topic_flags(self.bot, message.channel).disable_logging:
             return
 
         logging_channel = await self.get_logging_channel(message.guild, 'logs_delete_channel_id')
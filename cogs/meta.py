@@ -54,7 +54,7 @@ class Meta(commands.Cog):
         """Refresh a user profile on the website."""
 
         for who in whos:
-            await self.bot.api.add_user(who)
+            await self.bot.api.add_user(who, force=True)
             await ctx.send_to(f"{who.name}: https://getbeaned.me/users/{who.id}")
 
     @commands.command()
@@ -18,6 +18,9 @@ if typing.TYPE_CHECKING:
 
 from cogs.helpers.context import CustomContext
 
+# How many targets of a single command are acted on at the same time
+MULTIPLE_ACTIONS_CONCURRENCY = 5
+
 
 class Mod(commands.Cog):
     """
@@ -97,23 +100,50 @@ class Mod(commands.Cog):
 
     async def run_actions(self, ctx: 'CustomContext', users: typing.List[typing.Union[discord.Member, discord.User, ForcedMember, LikeUser]], reason: str,
                           attachments_saved_url: str, action: typing.Callable[[discord.Member, str], typing.Awaitable], duration: time.FutureTime = None):
-        cases_urls = []
-
         if duration:
             reason = reason + f"\n🕰️ Duration: {time.human_timedelta(duration.dt, source=datetime.datetime.utcnow())}"
 
-        for user in users:
-            act = await full_process(ctx.bot, action, user, ctx.author, reason, attachement_url=attachments_saved_url)
-            cases_urls.append(act['url'])
+        semaphore = asyncio.Semaphore(MULTIPLE_ACTIONS_CONCURRENCY)
 
-            if duration:
-                if action is mute:
-                    await self.api.create_task("unmute", arguments={"target": user.id, "guild": ctx.guild.id, "reason": f"Time is up | See case #{act['case_number']} for details"},
-                                               execute_at=duration.dt)
-                elif action is ban:
-                    await self.api.create_task("unban", arguments={"target": user.id, "guild": ctx.guild.id, "reason": f"Time is up | See case #{act['case_number']} for details"}, execute_at=duration.dt)
+        async def run_action(user):
+            async with semaphore:
+                act = await full_process(ctx.bot, action, user, ctx.author, reason, attachement_url=attachments_saved_url)
 
-        await ctx.send(f":ok_hand: - See {', '.join(cases_urls)} for details")
+                if duration:
+                    if act['case_number'] is not None:
+                        task_reason = f"Time is up | See case #{act['case_number']} for details"
+                    else:
+                        task_reason = "Time is up"
+
+                    if action is mute:
+                        await self.api.create_task("unmute", arguments={"target": user.id, "guild": ctx.guild.id, "reason": task_reason}, execute_at=duration.dt)
+                    elif action is ban:
+                        await self.api.create_task("unban", arguments={"target": user.id, "guild": ctx.guild.id, "reason": task_reason}, execute_at=duration.dt)
+
+                return act
+
+        # discord.py waits on the per-route rate limits by itself, the semaphore only keeps a few requests in flight
+        results = await asyncio.gather(*[run_action(user) for user in users], return_exceptions=True)
+
+        cases_urls = []
+        failures = []
+        for user, result in zip(users, results):
+            if isinstance(result, Exception):
+                ctx.logger.warning(f"Running {action.__name__} on {user.id} failed: {result!r}")
+                if isinstance(result, discord.errors.Forbidden):
+                    failures.append(f"{user.name}#{user.discriminator} (missing permissions)")
+                else:
+                    failures.append(f"{user.name}#{user.discriminator} ({type(result).__name__})")
+            else:
+                cases_urls.append(result['url'])
+
+        summary = []
+        if cases_urls or not failures:
+            summary.append(f":ok_hand: - See {', '.join(cases_urls)} for details")
+        if failures:
+            summary.append(f":x: Couldn't {action.__name__} {', '.join(failures)}")
+
+        await ctx.send("\n".join(summary))
 
     @commands.command()
     @commands.guild_only()
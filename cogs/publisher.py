@@ -9,6 +9,8 @@ if typing.TYPE_CHECKING:
 
 from discord.ext import commands
 
+from cogs.helpers.topic_flags import get_topic_flags
+
 
 class Publisher(commands.Cog):
     """
@@ -22,7 +24,7 @@ class Publisher(commands.Cog):
     async def on_message(self, message:discord.Message):
         if not message.guild:
             return
-        if not message.channel.topic or not "[getbeaned:auto_publish]" in message.channel.topic:
+        if not get_topic_flags(self.bot, message.channel).auto_publish:
             return
         if not message.channel.type == discord.ChannelType.news:
             return
@@ -102,6 +102,32 @@ class Importation(commands.Cog):
                           f"- **Your server profile**: https://getbeaned.me/users/{ctx.guild.id}/{user_id}\n"
                           f"- **Your global profile**: https://getbeaned.me/users/{user_id}")
 
+    @commands.command(aliases=["badregexes", "check_bad_words"])
+    @commands.guild_only()
+    @checks.have_required_level(4)
+    async def bad_regexes(self, ctx: 'CustomContext'):
+        """
+        Check your custom bad words and regexes, and see the ones the automod refused to use
+
+        You can edit them in your server settings in the webinterface. See `m+urls`
+        """
+
+        matcher = await self.bot.settings.get_bad_words_matcher(ctx.guild)
+
+        if not matcher.refused:
+            await ctx.send_to(':ok_hand: All your bad words and regexes are used by the automod.')
+            return
+
+        message = f"**{len(matcher.refused)} bad words or regexes are not used by the automod**:\n"
+        for pattern, reason in matcher.refused:
+            line = f"- `{pattern[:100]}`: {reason}\n"
+            if len(message) + len(line) > 1900:
+                message += "- ..."
+                break
+            message += line
+
+        await ctx.send_to(message)
+
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.guild):
         self.bot.logger.info(f"New server joined! {guild.id} - {guild.name} ({guild.member_count} members)")
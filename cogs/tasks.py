@@ -70,7 +70,7 @@ class Tasks(commands.Cog):
                 return True  # Returning true anyway
 
         if user is not None:
-            await self.bot.api.add_user(user)
+            await self.bot.api.add_user(user, force=True)
             return True
         else:
             self.bot.logger.warning(f"Completing task #{task['id']} failed. User not found.")